@@ -1,22 +1,23 @@
 import sys
 import os
+import concurrent.futures
 import time
 import logging
 import logging.handlers 
-import socket
 import requests
-from threading import Lock, Thread, Event
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from PIL import Image
-from io import BytesIO
+from threading import Thread, Event
 from flask import Flask
 from dotenv import load_dotenv
-from lib.waveshare_epd import epd7in5_V2
-from selenium.common.exceptions import WebDriverException, TimeoutException  
+from lib.waveshare_epd import epd7in5_V2, epdasync, epdbuffer, epdconfig, epddither
+from cloudflare import DNSUpdater, create_session
+from displayqueue import DisplayQueue
+from framecache import FrameCache
+from localip import LocalIP
+import metrics
+from metrics import span
+from renderer import BrowserRenderer, LocalRenderer, RenderError
+from resourcemonitor import ResourceMonitor
 import signal
-import psutil
 from waitress import serve
 import tempfile
 import urllib3
@@ -41,19 +42,6 @@ logging.basicConfig(level=logging.INFO,
 
 app = Flask(__name__)
 shutdown_event = Event()  # Event to signal shutdown across threads
-browser = None  # Persistent browser instance to keep it open continuously
-
-def log_open_fds(context=""):
-    """Log the current number of open file descriptors with a context."""
-    try:
-        process = psutil.Process(os.getpid())
-        if hasattr(process, 'num_fds'):
-            num_fds = process.num_fds()
-            logging.info(f"[{context}] Number of open file descriptors: {num_fds}")
-        else:
-            logging.info(f"[{context}] Cannot determine number of open file descriptors on this OS.")
-    except Exception as e:
-        logging.error(f"[{context}] Failed to log open file descriptors: {e}")
 
 try:
     epd = epd7in5_V2.EPD()
@@ -64,8 +52,8 @@ except Exception as e:
 
 display_initialized = True
 cleared_screen = True
+frame_cache = FrameCache()  # Packed frame currently on the panel
 use_second_flag = False
-update_lock = Lock()
 
 # Update intervals in seconds
 quick_update_interval = 15  # 15 seconds
@@ -74,25 +62,50 @@ last_quick_update = time.time()
 last_full_update = time.time()
 second_screen_view = time.time() # Timestamp for second screen view toggle
 seconds_change_interval = 300  # 5 minutes
+UPDATE_TIMEOUT = 120  # Longest time /updatescreen waits for the refresh, in seconds
+# Seconds the panel stays powered in partial mode after a quick update; the
+# next quick update within that time skips the reset and POWER ON, and the
+# panel goes to deep sleep once it has been idle that long (0: after every update)
+PANEL_IDLE_TIMEOUT = float(os.getenv("PANEL_IDLE_TIMEOUT", "60"))
+# Seconds between samples of the open files, memory and threads of the process;
+# they are logged only when they change noticeably or pass RESOURCE_MAX_FDS
+RESOURCE_SAMPLE_PERIOD = float(os.getenv("RESOURCE_SAMPLE_PERIOD", "60"))
+RESOURCE_MAX_FDS = int(os.getenv("RESOURCE_MAX_FDS", "512"))
+# Seconds between probes of the local IP where rtnetlink change notifications
+# are not available
+LOCAL_IP_INTERVAL = float(os.getenv("LOCAL_IP_INTERVAL", "60"))
+
+# Screen content source: "browser" renders the /screen page in headless Chrome,
+# "local" draws the layout with PIL from the data at SCREEN_DATA_URL
+RENDERER = os.getenv("RENDERER", "browser")
+# Browser capture backend: "cdp" keeps the page loaded and grabs frames over the
+# DevTools protocol, "selenium" reloads the page and takes a WebDriver screenshot
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "cdp")
+SCREEN_DATA_URL = os.getenv("SCREEN_DATA_URL", "https://localhost/screen/data")
+# Dithering of the frame to black and white: none, bayer, stable, floyd-steinberg or atkinson
+DITHER_MODE = os.getenv("DITHER_MODE", "floyd-steinberg")
+if DITHER_MODE not in epddither.MODES:
+    logging.warning("Unknown DITHER_MODE %r, using floyd-steinberg", DITHER_MODE)
+    DITHER_MODE = "floyd-steinberg"
+
+resource_monitor = ResourceMonitor(RESOURCE_SAMPLE_PERIOD, thresholds={"fds": RESOURCE_MAX_FDS})
 
 # Cloudflare API credentials
 CLOUDFLARE_API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
 CLOUDFLARE_ZONE_ID = os.getenv("CLOUDFLARE_ZONE_ID")
 CLOUDFLARE_RECORD_ID = os.getenv("CLOUDFLARE_RECORD_ID")
 CLOUDFLARE_DOMAIN = os.getenv("CLOUDFLARE_DOMAIN")
+# Seconds between checks of the DNS record while the local IP stays the same
+CLOUDFLARE_VERIFY_INTERVAL = float(os.getenv("CLOUDFLARE_VERIFY_INTERVAL", "3600"))
 
-# Initialize a single requests session
-session = requests.Session()
-session.headers.update({
-    "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-    "Content-Type": "application/json"
-})
+# Initialize a single requests session, kept alive for all Cloudflare calls
+session = create_session(CLOUDFLARE_API_TOKEN)
 
 def initialize_epaper():
     """Initialize and clear the e-paper display."""
     global display_initialized
     logging.info("Initializing e-paper display")
-    log_open_fds("initialize_epaper - start")
+    frame_cache.invalidate()
     try:
         epd.init()
         epd.Clear()
@@ -100,16 +113,35 @@ def initialize_epaper():
     except Exception as e:
         logging.error("Failed to initialize e-paper display: %s", e)
         display_initialized = False
-    finally:
-        log_open_fds("initialize_epaper - end")
 
 initialize_epaper()
 
+def sleep_idle_panel():
+    """Put the panel to deep sleep, called by the display worker once it has been idle for PANEL_IDLE_TIMEOUT."""
+    if epd.mode is not None:
+        logging.info("Panel idle for %.0f seconds, putting it to sleep", PANEL_IDLE_TIMEOUT)
+        try:
+            with span("sleep"):
+                epd.sleep()
+        except Exception as e:
+            logging.error("Error putting the panel to sleep: %s", e)
+            epd.mode = None
+
+# Drives the panel on its own thread, so refreshes (seconds of BUSY) block
+# neither the main loop nor the HTTP server
+display_worker = epdasync.DisplayWorker(
+    epd, PANEL_IDLE_TIMEOUT if PANEL_IDLE_TIMEOUT > 0 else None, sleep_idle_panel)
+
 def cleanup():
-    """Perform cleanup operations: clear and power down the display, close browser and session."""
+    """Perform cleanup operations: clear and power down the display, close renderer and session."""
     logging.info("Performing cleanup")
-    log_open_fds("cleanup - start")
+    resource_monitor.stop()
+    dns_updater.stop()
+    local_ip.close()
     try:
+        # Wait for the refresh in progress, the pending frame is dropped
+        display_queue.close()
+        display_worker.close()
         epd.init()
         epd.Clear()
         epd.sleep()
@@ -117,36 +149,33 @@ def cleanup():
     except Exception as e:
         logging.error("Error during display cleanup: %s", e)
     finally:
-        global browser
-        # Zamknij przeglądarkę jeśli istnieje
-        if browser is not None:
-            try:
-                logging.info("Closing browser during cleanup")
-                browser.quit()
-            except Exception as e:
-                logging.warning("Error closing browser: %s", e)
-            finally:
-                browser = None  # Zresetuj przeglądarkę
+        # Zamknij renderer (np. przeglądarkę)
+        try:
+            renderer.close()
+        except Exception as e:
+            logging.warning("Error closing renderer: %s", e)
         # Zamknij sesję requests
         try:
             session.close()
             logging.info("Requests session closed")
         except Exception as e:
             logging.error("Error closing requests session: %s", e)
-    log_open_fds("cleanup - end")
 
-def clear_screen():
-    """Clear the e-paper display."""
+def clear_panel():
+    """Display job: clear the e-paper display."""
     logging.info("Clearing screen")
-    log_open_fds("clear_screen - start")
+    frame_cache.invalidate()
     try:
         epd.init()
         epd.Clear()
         epd.sleep()
     except Exception as e:
         logging.error("Error clearing screen: %s", e)
-    finally:
-        log_open_fds("clear_screen - end")
+        epd.mode = None
+
+def clear_screen():
+    """Clear the e-paper display on the display worker, dropping any pending frame."""
+    return display_queue.submit_job(clear_panel)
 
 def check_website():
     """Check if the website is accessible and return the status code."""
@@ -157,132 +186,116 @@ def check_website():
     except requests.RequestException as e:
         return False
 
-def get_browser():
-    """Initialize and return a singleton instance of the Selenium WebDriver."""
-    global browser
-    if browser is not None:
-        try:
-            # Sprawdź czy przeglądarka jest jeszcze aktywna
-            browser.current_url  # Proste sprawdzenie statusu
-            return browser
-        except Exception as e:
-            logging.warning("Browser session invalid, reinitializing: %s", e)
-            browser = None
+def create_renderer():
+    """Create the renderer selected by the RENDERER environment variable."""
+    if RENDERER == "local":
+        logging.info("Using local PIL renderer with data from %s", SCREEN_DATA_URL)
+        return LocalRenderer(epd.width, epd.height, SCREEN_DATA_URL)
+    logging.info("Using browser renderer with %s capture", RENDER_BACKEND)
+    return BrowserRenderer(epd.width, epd.height, backend=RENDER_BACKEND)
+
+renderer = create_renderer()
+
+# Local IP address, probed again only when the kernel reports an address or
+# route change (or every LOCAL_IP_INTERVAL seconds without rtnetlink)
+local_ip = LocalIP.create(fallback_interval=LOCAL_IP_INTERVAL)
+
+# Points the Cloudflare record at the local IP, calling the API only when the
+# address changes, every CLOUDFLARE_VERIFY_INTERVAL seconds or to retry
+dns_updater = DNSUpdater(session, local_ip, CLOUDFLARE_ZONE_ID, CLOUDFLARE_RECORD_ID, CLOUDFLARE_DOMAIN,
+                         verify_interval=CLOUDFLARE_VERIFY_INTERVAL)
+
+def refresh_changed_regions(previous, buffer):
+    """Partially refresh only the parts of the screen that differ from the previous frame.
+
+    Returns False when no region changed and the panel was left alone.
+    """
+    if previous is None:
+        windows = [(0, 0, epd.width, epd.height)]
+    else:
+        windows = epdbuffer.dirty_windows(previous, buffer, epd.width, epd.height)
+    if not windows:
+        logging.info("Screen content unchanged, skipping refresh")
+        return False
+    logging.info("Refreshing %d changed region(s): %s", len(windows), windows)
+    with span("wake"):
+        epd.init_part_session()
+    for i, window in enumerate(windows):
+        last = i == len(windows) - 1
+        epd.display_Partial(epdbuffer.crop_window(buffer, epd.width, epd.height, window), *window, wait=not last)
+    display_worker.transferred()
+    epd.ReadBusy()
+    if PANEL_IDLE_TIMEOUT <= 0:
+        with span("sleep"):
+            epd.sleep()
+    return True
+
+def observe_panel(before):
+    """Record the SPI transfer and BUSY wait of one refresh from the driver counters."""
+    stats = epdconfig.stats
+    if stats["spi_bytes"] == before.get("spi_bytes", 0):
+        return  # nothing was sent
+    metrics.stage_seconds.observe(stats["spi_seconds"] - before.get("spi_seconds", 0), "transfer")
+    metrics.stage_seconds.observe(stats["busy_seconds"] - before.get("busy_seconds", 0), "busy")
+    metrics.transfer_bytes.observe(stats["spi_bytes"] - before.get("spi_bytes", 0))
+
+def show_frame(buffer, full_refresh=False):
+    """Display job: refresh the panel with the packed frame *buffer*.
+
+    Runs on the display worker, so the frame is compared with the one on the
+    panel only now; returns False when the refresh was skipped.
+    """
+    global display_initialized
+    if not full_refresh and frame_cache.lookup(buffer):
+        logging.info("Frame unchanged, skipping refresh (cache hits: %d, misses: %d)",
+                     frame_cache.hits, frame_cache.misses)
+        metrics.refreshes.inc("skipped")
+        return False
 
-    logging.info("Initializing browser")
-    log_open_fds("get_browser - start")
-    try:
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--window-size=800,525")
-        chrome_options.add_argument("--ignore-certificate-errors")
-        service = Service('/usr/bin/chromedriver')
-        browser = webdriver.Chrome(service=service, options=chrome_options)
-        browser.set_page_load_timeout(30)  # Ustaw timeout
-        logging.info("Browser initialized successfully")
-    except WebDriverException as e:
-        logging.error("Failed to initialize browser: %s", e)
-        browser = None
-    log_open_fds("get_browser - end")
-    return browser
-
-# Initialize browser once at startup
-browser = get_browser()
-
-def get_local_ip():
-    """Retrieve the local IP address of the machine."""
-    logging.info("Getting local IP")
-    log_open_fds("get_local_ip - start")
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Screen content is unknown until the refresh succeeds
+    previous_frame = frame_cache.frame
+    frame_cache.invalidate()
+    before = dict(epdconfig.stats)
+    refreshed = True
     try:
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-    except Exception as e:
-        logging.error("Error getting local IP: %s", e)
-        ip = "127.0.0.1"
+        if full_refresh:
+            with span("wake"):
+                epd.init()
+            epd.Clear()
+            epd.display(buffer, wait=False)
+            display_worker.transferred()
+            epd.ReadBusy()
+            with span("sleep"):
+                epd.sleep()
+            display_initialized = True
+        else:
+            refreshed = refresh_changed_regions(previous_frame, buffer)
+    except Exception:
+        epd.mode = None  # Reset the panel before the next refresh
+        raise
     finally:
-        s.close()
-    log_open_fds("get_local_ip - end")
-    return ip
-
-def get_cloudflare_ip():
-    """Retrieve the current IP address from Cloudflare DNS record."""
-    logging.info("Retrieving IP from Cloudflare")
-    log_open_fds("get_cloudflare_ip - start")
-    url = f"https://api.cloudflare.com/client/v4/zones/{CLOUDFLARE_ZONE_ID}/dns_records/{CLOUDFLARE_RECORD_ID}"
-    
-    with requests.Session() as temp_session:
-        temp_session.headers.update({
-            "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-            "Content-Type": "application/json"
-        })
-        try:
-            response = temp_session.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            current_ip = data.get("result", {}).get("content")
-            logging.info("Retrieved IP from Cloudflare: %s", current_ip)
-        except requests.RequestException as e:
-            logging.error("Request exception while retrieving IP from Cloudflare: %s", e)
-            current_ip = None
-    log_open_fds("get_cloudflare_ip - end")
-    return current_ip
-
-def update_cloudflare_dns(ip):
-    """Update Cloudflare DNS record with the given IP address, unless IP is 127.0.0.1."""
-    logging.info("Updating Cloudflare DNS")
-    log_open_fds("update_cloudflare_dns - start")
-    if ip == "127.0.0.1":
-        logging.info("Local IP is 127.0.0.1; skipping Cloudflare update.")
-        return
-
-    url = f"https://api.cloudflare.com/client/v4/zones/{CLOUDFLARE_ZONE_ID}/dns_records/{CLOUDFLARE_RECORD_ID}"
-    data = {
-        "type": "A",
-        "name": CLOUDFLARE_DOMAIN,
-        "content": ip,
-        "ttl": 120,
-        "comment": f"Updated by Python script on {time.strftime('%Y-%m-%d %H:%M:%S')}",
-        "proxied": False
-    }
-
-    try:
-        response = session.put(url, json=data, timeout=10)
-        response.raise_for_status()
-        logging.info("Cloudflare DNS record updated successfully with IP: %s", ip)
-    except requests.RequestException as e:
-        logging.error("Request exception while updating Cloudflare DNS: %s", e)
-    log_open_fds("update_cloudflare_dns - end")
-
-def periodic_cloudflare_update():
-    """Periodically check and update Cloudflare DNS record if IP changes."""
-    logging.info("Starting periodic Cloudflare update")
-    log_open_fds("periodic_cloudflare_update - start")
-    while not shutdown_event.is_set():
-        local_ip = get_local_ip()
-        cloudflare_ip = get_cloudflare_ip()
-
-        if local_ip != "127.0.0.1" and local_ip != cloudflare_ip:
-            logging.info("IP mismatch or scheduled update, updating Cloudflare.")
-            update_cloudflare_dns(local_ip)
-
-        # Wait for the next update interval (10 minutes)
-        for _ in range(600):
-            if shutdown_event.is_set():
-                break
-            time.sleep(1)
-    log_open_fds("periodic_cloudflare_update - end")
-
-def capture_and_display(full_refresh=False):
-    global display_initialized, second_screen_view, use_second_flag, browser
+        observe_panel(before)
+    frame_cache.store(buffer)
+    if not refreshed:
+        metrics.refreshes.inc("skipped")
+        return False
+    metrics.refreshes.inc("full" if full_refresh else "partial")
+    logging.info("Display updated with %s refresh", "full" if full_refresh else "partial")
+    return True
+
+def capture_image(request, item=None):
+    """Capture stage: render the screen for *request*.
+
+    Returns the grayscale image, or None when the screen did not change
+    since the last frame; raises RenderError when rendering failed after
+    the retries.
+    """
+    global second_screen_view, use_second_flag
     if shutdown_event.is_set():
-        return
+        return None
 
-    logging.info("Capturing and displaying")
-    log_open_fds("capture_and_display - start")
-    current_ip = get_local_ip()
+    logging.info("Capturing frame")
+    current_ip = local_ip.get()
 
     # Logic to toggle between second=true and normal view every 5 minutes
     if use_second_flag and (time.time() - second_screen_view > seconds_change_interval):
@@ -292,111 +305,146 @@ def capture_and_display(full_refresh=False):
         second_screen_view = time.time()
         use_second_flag = True
 
-    url = f"https://localhost/screen?ip={current_ip}"
-    if use_second_flag:
-        url += "&second=true"
-
     max_retries = 3
     retry_count = 0
+    image = None
 
     while retry_count < max_retries:
-        screenshot_io = None  # Inicjalizacja zmiennej
-        image = None  # Inicjalizacja zmiennej
         try:
-            logging.info("Refreshing page content for screenshot capture")
-            
-            # Sprawdź i zainicjuj przeglądarkę jeśli potrzebna
-            if browser is None:
-                browser = get_browser()
-                if browser is None:
-                    raise RuntimeError("Browser initialization failed")
-            
-            browser.set_page_load_timeout(30)  # Ustaw timeout na 30 sekund
-            browser.get(url)
-
-            screenshot = browser.get_screenshot_as_png()
-            screenshot_io = BytesIO(screenshot)
-            image = Image.open(screenshot_io).convert('L')
-            image = image.resize((epd.width, epd.height))
-
-            if full_refresh:
-                epd.init()
-                epd.Clear()
-                epd.display(epd.getbuffer(image))
-                epd.sleep()
-            else:
-                epd.init_part()
-                epd.display_Partial(epd.getbuffer(image), 0, 0, epd.width, epd.height)
-                epd.sleep()
-
-            logging.info("Display updated with %s refresh", "full" if full_refresh else "partial")
+            # Bez znanej zawartości ekranu zawsze pobierz nową klatkę
+            with span("capture"):
+                image = renderer.render(current_ip, use_second_flag,
+                                        force=request.full_refresh or frame_cache.digest is None)
+            if image is None:
+                logging.info("Screen content unchanged since the last frame, skipping refresh")
+                metrics.refreshes.inc("skipped")
             break  # Sukces - wyjdź z pętli
 
-        except TimeoutException as e:
-            logging.error("Page load timeout: %s", e)
-            retry_count += 1
-            logging.info("Restarting browser due to timeout (attempt %d/%d)", retry_count, max_retries)
-            try:
-                if browser:
-                    browser.quit()
-            except Exception as e:
-                logging.warning("Error closing browser: %s", e)
-            browser = None
-
         except Exception as e:
-            logging.error("Error capturing and displaying: %s", e)
+            logging.error("Error capturing frame: %s", e)
             retry_count += 1
-            logging.info("Restarting browser due to error (attempt %d/%d)", retry_count, max_retries)
-            try:
-                if browser:
-                    browser.quit()
-            except Exception as e:
-                logging.warning("Error closing browser: %s", e)
-            browser = None
-
-        finally:
-            # Bezpieczne zamykanie zasobów
-            if image is not None:
-                image.close()
-            if screenshot_io is not None:
-                screenshot_io.close()
-            
+            metrics.capture_retries.inc()
+            logging.info("Resetting renderer due to error (attempt %d/%d)", retry_count, max_retries)
+            renderer.reset()
+            metrics.browser_restarts.inc()
+
         time.sleep(5)  # Odczekaj przed ponowną próbą
 
-    log_open_fds("capture_and_display - end")
+    if retry_count >= max_retries:
+        raise RenderError("screen capture failed after %d attempts" % max_retries)
+    return image
+
+def convert_frame(request, image):
+    """Convert stage: dither the captured image and pack it for the panel."""
+    try:
+        with span("dither"):
+            dithered = epddither.dither_gray(image, epddither.GRAY2, DITHER_MODE)
+        with span("getbuffer"):
+            return bytes(epd.getbuffer(dithered))
+    finally:
+        # Bezpieczne zamykanie zasobów
+        image.close()
+
+def display_frame(request, buffer):
+    """Display stage: show the packed frame on the display worker and wait for the refresh."""
+    try:
+        with span("display"):
+            return display_worker.submit(show_frame, buffer, request.full_refresh).result()
+    except Exception as e:
+        logging.error("Error displaying frame %d: %s", request.id, e)
+        raise
+
+# Frames and render requests from the timer loop and the HTTP endpoint; the
+# latest one wins while the panel is busy.  Capture and conversion of the
+# next frame run on their own threads while the panel refreshes.
+display_queue = DisplayQueue(display_worker, [
+    ("capture", capture_image),
+    ("convert", convert_frame),
+    ("display", display_frame),
+])
 
 @app.route('/updatescreen', methods=['GET'])
 def update_screen():
     logging.info("Received request to update screen")
-    with update_lock:
-        if not display_initialized:
-            logging.info("Reinitializing display as it was not initialized")
-            initialize_epaper()
-        capture_and_display(full_refresh=True)
-        return "Screen updated successfully", 200
+    # The full refresh reinitialises the display; a request still waiting
+    # when a newer one arrives is answered with the frame shown instead
+    future = display_queue.submit(full_refresh=True, source="http")
+    try:
+        shown = future.result(timeout=UPDATE_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        return {"requested": future.request_id, "status": "queued"}, 202
+    except concurrent.futures.CancelledError:
+        return {"requested": future.request_id, "status": "dropped"}, 409
+    except RenderError as e:
+        # no frame to show, the screen source is down
+        return {"requested": future.request_id, "status": "failed", "error": str(e)}, 502
+    except Exception as e:
+        return {"requested": future.request_id, "status": "failed", "error": str(e)}, 500
+    # not refreshed: the frame was already on the panel
+    return {"requested": future.request_id, "shown": shown.id, "refreshed": shown.refreshed,
+            "status": "updated" if shown.refreshed else "unchanged"}, 200
+
+@app.route('/displayqueue', methods=['GET'])
+def display_queue_stats():
+    """Return the counters of the display queue."""
+    return display_queue.stats(), 200
+
+def frame_cache_hit_ratio():
+    return frame_cache.stats()["hit_ratio"]
+
+def chrome_memory():
+    """Return the resident memory of the child processes (Chrome and chromedriver) in bytes, as last sampled."""
+    sample = resource_monitor.latest()
+    return sample.chrome_rss if sample is not None else None
+
+# Read when /metrics is scraped
+metrics.registry.gauge("epaper_frame_cache_hit_ratio", "Share of frames found unchanged on the panel.",
+                       fn=frame_cache_hit_ratio)
+metrics.registry.gauge("epaper_browser_resident_memory_bytes",
+                       "Resident memory of the Chrome and chromedriver processes in bytes.", fn=chrome_memory)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Return the refresh timings and counters in the Prometheus text format."""
+    return metrics.registry.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+@app.route('/localip', methods=['GET'])
+def local_ip_stats():
+    """Return the cached local IP and how often it was probed."""
+    return local_ip.stats(), 200
+
+@app.route('/cloudflare', methods=['GET'])
+def cloudflare_stats():
+    """Return the address confirmed in the DNS record and the API request counters."""
+    return dns_updater.stats(), 200
+
+@app.route('/resources', methods=['GET'])
+def resource_samples():
+    """Return the last samples of the resource monitor."""
+    return {"period": resource_monitor.period, "samples": resource_monitor.stats()}, 200
+
+@app.route('/framecache', methods=['GET'])
+def frame_cache_stats():
+    """Return the hit/miss counters of the displayed frame cache."""
+    return frame_cache.stats(), 200
 
 def main_loop():
     """Main loop that handles periodic screen updates."""
     global last_quick_update, last_full_update, display_initialized, cleared_screen
     logging.info("Entering main loop")
-    log_open_fds("main_loop - start")
     try:
         while not shutdown_event.is_set():
             try:
                 if check_website():
                     cleared_screen = False
                     current_time = time.time()
-                    if update_lock.locked():
-                        logging.debug("Update lock is active, sleeping for 0.5 seconds")
-                        time.sleep(0.5)
-                        continue
-                    with update_lock:
-                        if current_time - last_full_update >= full_update_interval:
-                            capture_and_display(full_refresh=True)
-                            last_full_update = current_time
-                        elif current_time - last_quick_update >= quick_update_interval:
-                            capture_and_display(full_refresh=False)
-                            last_quick_update = current_time
+                    if current_time - last_full_update >= full_update_interval:
+                        display_queue.submit(full_refresh=True, source="timer")
+                        last_full_update = current_time
+                    elif current_time - last_quick_update >= quick_update_interval:
+                        display_queue.submit(full_refresh=False, source="timer")
+                        last_quick_update = current_time
+                    shutdown_event.wait(0.5)
                 else:
                     logging.warning("Website is not accessible, waiting 10 seconds")
                     if not cleared_screen:
@@ -411,15 +459,12 @@ def main_loop():
         logging.error("Critical error in main loop: %s", e)
     finally:
         cleanup()
-    log_open_fds("main_loop - end")
 
 def start_flask_server():
     """Start the Flask server using Waitress in a separate daemon thread."""
     logging.info("Starting Flask server with Waitress")
-    log_open_fds("start_flask_server - start")
     server = Thread(target=lambda: serve(app, host='0.0.0.0', port=5002), daemon=True)
     server.start()
-    log_open_fds("start_flask_server - end")
     return server
 
 if __name__ == "__main__":
@@ -433,8 +478,8 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, signal_handler)
 
     start_flask_server()
+    resource_monitor.start()
 
-    cloudflare_thread = Thread(target=periodic_cloudflare_update, daemon=True)
-    cloudflare_thread.start()
+    dns_updater.start()
 
     main_loop()
\ No newline at end of file
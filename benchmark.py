@@ -0,0 +1,432 @@
+"""Benchmarks of the frame conversion paths of the e-paper drivers.
+
+Also checks the network helpers of app.py against scripted stand-ins (fake
+netlink events, a local HTTP server).  Runs without the display attached,
+e.g.:
+
+    python benchmark.py
+"""
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from lib.waveshare_epd import epdbuffer, epdcolor, epddither
+
+# Panels with a 4 gray mode, (width, height)
+GRAY_PANELS = {
+    "epd2in7": (176, 264),
+    "epd2in9_V2": (128, 296),
+    "epd3in7": (280, 480),
+    "epd4in2": (400, 300),
+    "epd4in26": (800, 480),
+    "epd5in79": (792, 272),
+    "epd7in5_V2": (800, 480),
+    "epd13in3k": (960, 680),
+}
+
+# Colour panels, (width, height, palette, bits per pixel)
+COLOR_PANELS = {
+    "epd5in65f": (600, 448, epdcolor.PALETTE_7COLOR, 4),
+    "epd7in3f": (800, 480, epdcolor.PALETTE_7COLOR, 4),
+    "epd7in3e": (800, 480, epdcolor.PALETTE_6COLOR, 4),
+    "epd4in37g": (512, 368, epdcolor.PALETTE_4COLOR, 2),
+    "epd7in3g": (800, 480, epdcolor.PALETTE_4COLOR, 2),
+}
+
+
+# Black/white panels used for the dithering benchmark, (width, height)
+MONO_PANELS = {
+    "epd2in13_V4": (122, 250),
+    "epd4in2_V2": (400, 300),
+    "epd7in5_V2": (800, 480),
+    "epd13in3k": (960, 680),
+}
+
+
+def legacy_getbuffer_4Gray(image, width, height):
+    """The per-pixel getbuffer_4Gray loop the drivers used before epdbuffer."""
+    buf = [0xFF] * (int(width / 4) * height)
+    image_monocolor = image.convert('L')
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    i = 0
+    for y in range(imheight):
+        for x in range(imwidth):
+            if pixels[x, y] == 0xC0:
+                pixels[x, y] = 0x80
+            elif pixels[x, y] == 0x80:
+                pixels[x, y] = 0x40
+            i = i + 1
+            if i % 4 == 0:
+                buf[int((x + (y * width)) / 4)] = ((pixels[x-3, y] & 0xc0) | (pixels[x-2, y] & 0xc0) >> 2 | (pixels[x-1, y] & 0xc0) >> 4 | (pixels[x, y] & 0xc0) >> 6)
+    return buf
+
+
+def legacy_split_4gray(image, count):
+    """The per-byte first RAM plane loop of epd7in5_V2.display_4Gray."""
+    buf = []
+    for i in range(0, count):
+        temp3 = 0
+        for j in range(0, 2):
+            temp1 = image[i*2+j]
+            for k in range(0, 2):
+                temp2 = temp1 & 0xC0
+                if temp2 == 0xC0:
+                    temp3 |= 0x00
+                elif temp2 == 0x00:
+                    temp3 |= 0x01
+                elif temp2 == 0x80:
+                    temp3 |= 0x01
+                else:
+                    temp3 |= 0x00
+                temp3 <<= 1
+
+                temp1 <<= 2
+                temp2 = temp1 & 0xC0
+                if temp2 == 0xC0:
+                    temp3 |= 0x00
+                elif temp2 == 0x00:
+                    temp3 |= 0x01
+                elif temp2 == 0x80:
+                    temp3 |= 0x01
+                else:
+                    temp3 |= 0x00
+                if j != 1 or k != 1:
+                    temp3 <<= 1
+                temp1 <<= 2
+        buf.append(temp3)
+    return buf
+
+
+def legacy_getbuffer_palette(image, width, height, palette, bits):
+    """The quantize + per-pixel packing loop of the colour drivers' getbuffer."""
+    pal_image = Image.new("P", (1,1))
+    pal_image.putpalette(sum(palette, ()) + (0,0,0)*(256 - len(palette)))
+    buf_color = bytearray(image.convert("RGB").quantize(palette=pal_image).tobytes('raw'))
+    per_byte = 8 // bits
+    buf = [0x00] * int(width * height / per_byte)
+    idx = 0
+    for i in range(0, len(buf_color), per_byte):
+        value = 0
+        for j in range(per_byte):
+            value = (value << bits) + buf_color[i+j]
+        buf[idx] = value
+        idx += 1
+    return buf
+
+
+def timed(func, *args, repeat=1):
+    """Return the result of func(*args) and its average run time in ms."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return result, (time.perf_counter() - start) * 1000 / repeat
+
+
+def gray_frame(width, height):
+    """Random frame using the four gray levels of the drivers."""
+    levels = bytes([0x00, 0x80, 0xC0, 0xFF])
+    data = bytes(levels[b & 3] for b in os.urandom(width * height))
+    return Image.frombytes('L', (width, height), data)
+
+
+def color_frame(width, height):
+    """Random RGB frame."""
+    return Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+
+
+def dashboard_frame(clock, width=800, height=480):
+    """Synthetic dashboard in the style of the /screen page, showing *clock*.
+
+    Anti-aliased text, a gray header, a filled chart and a smooth "album
+    cover", i.e. the gray content that dithering has to deal with.
+    """
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, 150), fill=208)
+    draw.text((24, 10), clock, font=ImageFont.load_default(110), fill=0)
+    draw.text((24, 165), "Temperatura 21.5 C, wilgotnosc 48%", font=ImageFont.load_default(28), fill=96)
+    points = [(24 + x * 24, 420 - int(60 + 50 * np.sin(x / 3.0))) for x in range(21)]
+    draw.polygon(points + [(504, 460), (24, 460)], fill=170)
+    draw.line(points, fill=0, width=3)
+    noise = np.random.default_rng(7).integers(0, 256, (200, 200), dtype=np.uint8)
+    cover = Image.fromarray(noise, 'L').filter(ImageFilter.GaussianBlur(12))
+    image.paste(cover.point(lambda v: (v - 100) * 4), (width - 240, 220))
+    return image
+
+
+def frame_change(old_frame, new_frame, mode, width=800, height=480):
+    """Changed bytes and partial refresh window bytes between two dithered frames."""
+    old, new = (epdbuffer.pack_1bit(epddither.dither_gray(frame, epddither.GRAY2, mode),
+                                    width, height, rotate_first=True, invert=True)
+                for frame in (old_frame, new_frame))
+    changed = int(np.count_nonzero(np.frombuffer(old, np.uint8) != np.frombuffer(new, np.uint8)))
+    windows = epdbuffer.dirty_windows(old, new, width, height)
+    window_bytes = sum((xend - xstart) // 8 * (yend - ystart) for xstart, ystart, xend, yend in windows)
+    return changed, window_bytes
+
+
+def benchmark_temporal():
+    """Bytes that differ between two dashboard frames a minute apart, per dithering mode.
+
+    Error diffusion spreads a change of the clock digits over the rest of
+    the frame, which grows the windows of the diff based partial refresh;
+    the ordered modes only change the pixels that changed.  The second case
+    adds +-4 of noise to the new frame (video or photo content, lossy
+    captures), which the stable mode absorbs in flat areas where bayer does not.
+    """
+    old = dashboard_frame("12:34")
+    new = dashboard_frame("12:35")
+    noise = np.random.default_rng(8).integers(-4, 5, (new.height, new.width))
+    noisy = Image.fromarray(np.clip(np.asarray(new, dtype=np.int16) + noise, 0, 255).astype(np.uint8), 'L')
+    total = old.width * old.height // 8
+    print("frame change 12:34 -> 12:35        changed bytes   window bytes    with noise: changed   window")
+    for mode in epddither.MODES:
+        changed, window = frame_change(old, new, mode)
+        noisy_changed, noisy_window = frame_change(old, noisy, mode)
+        print("%-24s %10d %6.2f%% %14d %20d %8d" % (
+            mode, changed, changed * 100.0 / total, window, noisy_changed, noisy_window))
+
+
+def benchmark_4gray():
+    print("getbuffer_4Gray               legacy ms   packed ms   identical")
+    for name, (width, height) in GRAY_PANELS.items():
+        image = gray_frame(width, height)
+        old, old_ms = timed(legacy_getbuffer_4Gray, image, width, height)
+        new, new_ms = timed(epdbuffer.pack_4gray, image, width, height, repeat=20)
+        print("%-12s %4dx%-4d %14.1f %11.2f   %s" % (
+            name, width, height, old_ms, new_ms, bytes(old) == bytes(new)))
+
+
+def benchmark_4gray_planes():
+    print("display_4Gray plane           legacy ms    split ms   identical")
+    for name, (width, height) in GRAY_PANELS.items():
+        buf = epdbuffer.pack_4gray(gray_frame(width, height), width, height)
+        old, old_ms = timed(legacy_split_4gray, buf, width * height // 8)
+        new, new_ms = timed(epdbuffer.split_4gray, buf, (1, 0, 1, 0), repeat=20)
+        print("%-12s %4dx%-4d %14.1f %11.2f   %s" % (
+            name, width, height, old_ms, new_ms, bytes(old) == bytes(new)))
+
+
+def benchmark_palette():
+    print("colour getbuffer              legacy ms   packed ms   identical   LUT ms")
+    for name, (width, height, palette, bits) in COLOR_PANELS.items():
+        image = color_frame(width, height)
+        old, old_ms = timed(legacy_getbuffer_palette, image, width, height, palette, bits)
+        new, new_ms = timed(epdcolor.pack_palette, image, width, height, palette, bits, repeat=5)
+        epdcolor.rgb_lut(palette)  # built once, not part of the per-frame cost
+        _, lut_ms = timed(epdcolor.pack_palette, image, width, height, palette, bits, False, 5, repeat=5)
+        print("%-12s %4dx%-4d %14.1f %11.2f   %-9s %8.2f" % (
+            name, width, height, old_ms, new_ms, bytes(old) == bytes(new), lut_ms))
+
+
+def benchmark_dither():
+    print("dithering ms/frame       " + "".join("%16s" % mode for mode in epddither.MODES))
+    rows = [(name, size, "1 bit", lambda image, mode: epddither.dither_gray(image, epddither.GRAY2, mode))
+            for name, size in MONO_PANELS.items()]
+    rows += [(name, size, "4 gray", lambda image, mode: epddither.dither_gray(image, epddither.GRAY4, mode))
+             for name, size in GRAY_PANELS.items()]
+    rows += [(name, (width, height), "colour",
+              lambda image, mode, palette=palette: epddither.dither_palette(image, palette, mode))
+             for name, (width, height, palette, bits) in COLOR_PANELS.items()]
+    for name, (width, height), kind, func in rows:
+        image = color_frame(width, height)
+        times = []
+        for mode in epddither.MODES:
+            _, ms = timed(func, image, mode, repeat=1 if mode == "atkinson" else 5)
+            times.append(ms)
+        print("%-12s %4dx%-4d %-6s" % (name, width, height, kind) + "".join("%16.1f" % ms for ms in times))
+
+
+def benchmark_driver():
+    """Host time, wire bytes and decoded output of the epd7in5_V2 refreshes, on the virtual backend.
+
+    identical tells whether the window of the screen rebuilt from the
+    command stream matches the frame that was sent.
+    """
+    os.environ["EPD_BACKEND"] = "virtual"
+    os.environ.setdefault("EPD_VIRTUAL_TIMESCALE", "0")
+    from lib.waveshare_epd import epdconfig, epd7in5_V2
+
+    epd = epd7in5_V2.EPD()
+    epd.init()
+    image = dashboard_frame("12:34").convert('1')
+    buf = bytes(epd.getbuffer(image))
+    window = buf[:epd.width // 8 * 80]
+    print("epd7in5_V2 virtual             host ms   wire bytes   transfers   identical")
+    for name, func, args, expected in [
+        ("Clear", epd.Clear, (), Image.new('1', image.size, 255)),
+        ("display", epd.display, (buf,), image),
+        ("display_Partial 800x80", epd.display_Partial, (window, 0, 0, epd.width, 80), image.crop((0, 0, epd.width, 80))),
+    ]:
+        _, ms = timed(func, *args, repeat=5)
+        refresh = epdconfig.frames[-1]
+        identical = refresh.image.crop(refresh.window).tobytes() == expected.tobytes()
+        print("%-24s %13.2f %12d %11d   %s" % (name, ms, refresh.bytes, refresh.transfers, identical))
+
+
+def netlink_message(kind, seq=0):
+    """Return a netlink datagram with one empty message of type *kind*."""
+    from localip import NLMSGHDR
+
+    return NLMSGHDR.pack(NLMSGHDR.size, kind, 0, seq, 0)
+
+
+def check_local_ip():
+    """Probes of LocalIP fed with scripted rtnetlink events through an EventSource.
+
+    The cached address must be probed again after RTM_NEWADDR/RTM_DELADDR
+    (and route changes) only, not after other messages or while idle.
+    """
+    import localip
+
+    RTM_NEWLINK = 16
+    address = ["192.0.2.10"]
+    probes = []
+
+    def probe():
+        probes.append(address[0])
+        return address[0]
+
+    source = localip.EventSource()
+    ip = localip.LocalIP(source, probe=probe, interval=60).start()
+    print("local IP event                 probes   cached address")
+    steps = [
+        ("start", None, None),
+        ("RTM_NEWLINK", RTM_NEWLINK, None),
+        ("idle 0.3 s", None, None),
+        ("RTM_NEWADDR", localip.RTM_NEWADDR, "192.0.2.20"),
+        ("RTM_NEWLINK + RTM_DELADDR", (RTM_NEWLINK, localip.RTM_DELADDR), "192.0.2.10"),
+        ("RTM_NEWROUTE, same address", localip.RTM_NEWROUTE, None),
+    ]
+    expected_probes = [1, 1, 1, 2, 3, 4]
+    try:
+        for (name, kind, new_address), expected in zip(steps, expected_probes):
+            known = ip.get()
+            if new_address is not None:
+                address[0] = new_address
+            if kind is not None:
+                kinds = kind if isinstance(kind, tuple) else (kind,)
+                source.notify(b"".join(netlink_message(k, seq) for seq, k in enumerate(kinds)))
+            if new_address is not None:
+                assert ip.wait_for_change(known, 2) == new_address, name
+            else:
+                time.sleep(0.3)
+            assert len(probes) == expected, (name, probes)
+            print("%-28s %8d   %s" % (name, len(probes), ip.get()))
+    finally:
+        ip.close()
+
+
+def cloudflare_stand_in(record_ip):
+    """Start a local HTTP server answering like the Cloudflare DNS record API, returns it.
+
+    server.requests logs (time, method, client port, content of a PUT,
+    status); server.fail_puts makes that many PUTs answer 500.
+    """
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse shows
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.server.requests.append((time.monotonic(), "GET", self.client_address[1], None, 200))
+            self.reply(200, {"success": True, "result": {"content": self.server.record_ip}})
+
+        def do_PUT(self):
+            content = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["content"]
+            status = 200
+            if self.server.fail_puts:
+                self.server.fail_puts -= 1
+                status = 500
+            else:
+                self.server.record_ip = content
+            self.server.requests.append((time.monotonic(), "PUT", self.client_address[1], content, status))
+            self.reply(status, {"success": status == 200, "result": {"content": self.server.record_ip}})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.record_ip = record_ip
+    server.fail_puts = 0
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_cloudflare():
+    """DNSUpdater against a local stand-in for the Cloudflare API.
+
+    While the local IP stays the same only the verification GETs go out; a
+    change of the IP is PUT at once, a failed PUT is retried with a doubling
+    delay, and every request reuses the one pooled connection.
+    """
+    import cloudflare
+    import localip
+
+    address = ["192.0.2.10"]
+    server = cloudflare_stand_in(address[0])
+    source = localip.EventSource()
+    ip = localip.LocalIP(source, probe=lambda: address[0], interval=60).start()
+    updater = cloudflare.DNSUpdater(
+        cloudflare.create_session("token"), ip, "zone", "record", "home.example.com",
+        api_url="http://127.0.0.1:%d/client/v4" % server.server_address[1],
+        verify_interval=0.6, backoff=0.1, max_backoff=1)
+    start = time.monotonic()
+    try:
+        updater.start()
+        time.sleep(0.9)  # first check and one verification
+        server.fail_puts = 2
+        address[0] = "192.0.2.20"
+        source.notify(netlink_message(localip.RTM_NEWADDR))
+        time.sleep(0.5)  # the PUT, two retries after 0.1 and 0.2 s
+    finally:
+        updater.stop()
+        ip.close()
+        server.shutdown()
+        updater.session.close()
+
+    print("cloudflare stand-in      ms   request   content       status   connection")
+    ports = []
+    for at, method, port, content, status in server.requests:
+        if port not in ports:
+            ports.append(port)
+        print("%19.0f   %-9s %-13s %6d   %d" % (
+            (at - start) * 1000, method, content or "", status, ports.index(port) + 1))
+    methods = [method for _, method, _, _, _ in server.requests]
+    puts = [(at, content, status) for at, method, _, content, status in server.requests if method == "PUT"]
+    # initial GET and the verification, no PUT while the IP stays the same
+    assert methods[:2] == ["GET", "GET"], methods
+    assert [content for _, content, _ in puts] == ["192.0.2.20"] * 3, puts
+    assert [status for _, _, status in puts] == [500, 500, 200], puts
+    gaps = [b[0] - a[0] for a, b in zip(puts, puts[1:])]
+    assert gaps[0] >= 0.1 and gaps[1] >= 0.2, gaps
+    assert server.record_ip == "192.0.2.20" and updater.confirmed_ip == "192.0.2.20"
+    assert len(ports) == 1, ports
+    print("backoff between PUTs: %s ms, %d connection(s), %d requests" % (
+        ", ".join("%.0f" % (gap * 1000) for gap in gaps), len(ports), len(server.requests)))
+
+
+if __name__ == "__main__":
+    benchmark_4gray()
+    benchmark_4gray_planes()
+    benchmark_palette()
+    benchmark_dither()
+    benchmark_temporal()
+    benchmark_driver()
+    check_local_ip()
+    check_cloudflare()
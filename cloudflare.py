@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+API_URL = "https://api.cloudflare.com/client/v4"
+
+FALLBACK_IP = "127.0.0.1"
+
+
+def create_session(token):
+    """Return a session with the API token and a single kept-alive connection."""
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    })
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class DNSUpdater:
+    """Keeps a Cloudflare A record pointing at the local IP address.
+
+    Remembers the address last confirmed in the record and calls the API
+    only when needed: when the local address changes (see
+    LocalIP.wait_for_change), every *verify_interval* seconds to catch
+    edits made elsewhere, and after a failed request, retried with an
+    exponential backoff from *backoff* up to *max_backoff* seconds.  All
+    requests go through one pooled session, so the TLS connection is
+    reused.  *api_url* can point at a local stand-in server for testing.
+    """
+
+    def __init__(self, session, local_ip, zone_id, record_id, domain, api_url=API_URL,
+                 verify_interval=3600, backoff=30, max_backoff=1800, timeout=10, name="cloudflare-dns"):
+        self.session = session
+        self.local_ip = local_ip
+        self.domain = domain
+        self.url = f"{api_url}/zones/{zone_id}/dns_records/{record_id}"
+        self.verify_interval = verify_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        # address the record was last seen or set to, None when unknown
+        self.confirmed_ip = None
+        self.verified_at = 0.0
+        self.failures = 0
+        self.requests = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def fetch(self):
+        """Return the address in the DNS record."""
+        logging.info("Retrieving IP from Cloudflare")
+        self.requests += 1
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get("result", {}).get("content")
+
+    def put(self, ip):
+        """Point the DNS record at *ip*."""
+        logging.info("Updating Cloudflare DNS")
+        data = {
+            "type": "A",
+            "name": self.domain,
+            "content": ip,
+            "ttl": 120,
+            "comment": f"Updated by Python script on {time.strftime('%Y-%m-%d %H:%M:%S')}",
+            "proxied": False
+        }
+        self.requests += 1
+        response = self.session.put(self.url, json=data, timeout=self.timeout)
+        response.raise_for_status()
+
+    def sync(self, ip):
+        """Make sure the record holds *ip*; returns False when a request failed."""
+        if ip == FALLBACK_IP:
+            logging.info("Local IP is 127.0.0.1; skipping Cloudflare update.")
+            metrics.cloudflare_updates.inc("skipped")
+            return True
+        try:
+            if self.confirmed_ip is None or time.monotonic() - self.verified_at >= self.verify_interval:
+                self.confirmed_ip = self.fetch()
+                self.verified_at = time.monotonic()
+                logging.info("Retrieved IP from Cloudflare: %s", self.confirmed_ip)
+            if self.confirmed_ip == ip:
+                metrics.cloudflare_updates.inc("unchanged")
+                return True
+            logging.info("IP mismatch, updating Cloudflare from %s to %s", self.confirmed_ip, ip)
+            self.confirmed_ip = None
+            self.put(ip)
+        except (requests.RequestException, ValueError) as e:
+            logging.error("Request exception while updating Cloudflare DNS: %s", e)
+            metrics.cloudflare_updates.inc("failed")
+            self.confirmed_ip = None
+            return False
+        self.confirmed_ip = ip
+        self.verified_at = time.monotonic()
+        logging.info("Cloudflare DNS record updated successfully with IP: %s", ip)
+        metrics.cloudflare_updates.inc("updated")
+        return True
+
+    def delay(self):
+        """Return the seconds until the next check, backing off after failures."""
+        if self.failures:
+            return min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+        return self.verify_interval
+
+    def run(self):
+        logging.info("Starting Cloudflare DNS updater")
+        ip = self.local_ip.get()
+        while not self.stopped.is_set() and not self.local_ip.closed:
+            if self.sync(ip):
+                self.failures = 0
+            else:
+                self.failures += 1
+            deadline = time.monotonic() + self.delay()
+            known = ip
+            # sleep until the address changes, the check is due or stop()
+            while not self.stopped.is_set() and not self.local_ip.closed and ip == known:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                ip = self.local_ip.wait_for_change(known, min(remaining, 5))
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        """Return the confirmed address and the request and failure counters."""
+        return {
+            "confirmed_ip": self.confirmed_ip,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
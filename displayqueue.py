@@ -0,0 +1,181 @@
+import collections
+import concurrent.futures
+import queue
+import threading
+
+# A frame to show: *buffer* is a packed frame, or None to render the screen
+# first; source names the producer, e.g. "timer" or "http".
+DisplayRequest = collections.namedtuple("DisplayRequest", "id full_refresh buffer source")
+
+# Outcome of a request: the id of the request whose frame was shown (a later
+# one when the request was superseded) and whether the panel was refreshed.
+Shown = collections.namedtuple("Shown", "id refreshed")
+
+
+class DisplayQueue:
+    """Single slot, latest wins queue between the frame producers and the panel.
+
+    Producers (the timer loop, the HTTP endpoint, push triggers) submit
+    frames or render requests and get a future back.  Only one request waits
+    at a time: a newer one replaces it, the replaced request is dropped and
+    its future resolves to the outcome of the request that replaced it.  A
+    full refresh is never lost that way, the replacing request inherits it.
+
+    The requests then go through *stages*, a list of (name, fn) pairs, each
+    stage on its own thread: fn(request, item) gets the result of the
+    previous stage (the first one gets None) and returns the item for the
+    next one, or None when there is nothing to show.  The last stage drives
+    the panel and returns whether it was refreshed.  The stages are linked by
+    queues of *depth* items; a full queue blocks the stage before it, and at
+    most one request per stage is in flight, so while the panel refreshes
+    one frame the next ones are captured and converted, and no more.
+    Requests carrying a frame go straight to the last stage.
+    """
+
+    def __init__(self, worker, stages, depth=1):
+        self.worker = worker
+        self.stages = stages
+        self.condition = threading.Condition()
+        self.pending = None
+        self.waiting = []
+        self.closed = False
+        # bumped by submit_job(), requests taken before it are dropped
+        self.epoch = 0
+        self.last_id = 0
+        self.submitted = 0
+        self.superseded = 0
+        self.handled = 0
+        self.shown = 0
+        self.queues = [queue.Queue(maxsize=depth) for _ in stages[1:]]
+        # at most one request per stage is in flight, further requests wait
+        # in the slot where the latest one wins
+        self.in_flight = threading.Semaphore(len(stages))
+        self.threads = [
+            threading.Thread(target=self.run_stage, args=(index,), name="display-%s" % name, daemon=True)
+            for index, (name, fn) in enumerate(stages)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, full_refresh=False, buffer=None, source=None):
+        """Queue a frame (or a render request when *buffer* is None), returns a future of Shown.
+
+        The future's request_id is the id given to this request.
+        """
+        future = concurrent.futures.Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("display queue is closed")
+            self.last_id += 1
+            self.submitted += 1
+            future.request_id = self.last_id
+            if self.pending is not None:
+                self.superseded += 1
+                full_refresh = full_refresh or self.pending.full_refresh
+            self.pending = DisplayRequest(self.last_id, full_refresh, buffer, source)
+            self.waiting.append(future)
+            self.condition.notify()
+        return future
+
+    def take(self):
+        """Wait for the pending request, returns (epoch, request, futures) or None once closed."""
+        self.in_flight.acquire()
+        with self.condition:
+            while self.pending is None and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                self.in_flight.release()
+                return None
+            job = (self.epoch, self.pending, self.waiting)
+            self.pending, self.waiting = None, []
+        waiting = [future for future in job[2] if future.set_running_or_notify_cancel()]
+        return job[0], job[1], waiting
+
+    def run_stage(self, index):
+        name, fn = self.stages[index]
+        last = len(self.stages) - 1
+        while True:
+            if index == 0:
+                job = self.take()
+                item = None
+            else:
+                job = self.queues[index - 1].get()
+            if job is None:
+                # closed: pass the end on to the next stage
+                if index < last:
+                    self.queues[index].put(None)
+                return
+            if index > 0:
+                job, item = job
+            epoch, request, waiting = job
+            if epoch != self.epoch:
+                self.drop(waiting)
+                continue
+            if index == 0 and request.buffer is not None:
+                if last > 0:
+                    self.queues[last - 1].put((job, request.buffer))
+                    continue
+                item = request.buffer
+            try:
+                item = fn(request, item)
+            except Exception as e:
+                self.in_flight.release()
+                for future in waiting:
+                    future.set_exception(e)
+                continue
+            if index == last:
+                self.finish(request, waiting, item)
+            elif item is None:
+                self.finish(request, waiting, False)
+            else:
+                # blocks while the next stage still has an item waiting
+                self.queues[index].put((job, item))
+
+    def finish(self, request, waiting, refreshed):
+        shown = Shown(request.id, bool(refreshed))
+        self.in_flight.release()
+        with self.condition:
+            self.handled += 1
+            if refreshed:
+                self.shown += 1
+        for future in waiting:
+            future.set_result(shown)
+
+    def drop(self, waiting):
+        self.in_flight.release()
+        for future in waiting:
+            future.set_exception(concurrent.futures.CancelledError())
+
+    def submit_job(self, job):
+        """Drop the pending and in-flight requests and run *job* on the worker, e.g. to clear the screen.
+
+        The futures of the dropped requests raise CancelledError.
+        """
+        with self.condition:
+            waiting = self.waiting
+            if self.pending is not None:
+                self.superseded += 1
+            self.pending, self.waiting = None, []
+            self.epoch += 1
+            future = self.worker.submit(job)
+        for dropped in waiting:
+            dropped.cancel()
+        return future
+
+    def close(self):
+        """Stop the stages once the requests in flight are done, dropping the pending one."""
+        with self.condition:
+            self.closed = True
+            waiting, self.pending, self.waiting = self.waiting, None, []
+            self.condition.notify_all()
+        for future in waiting:
+            future.cancel()
+
+    def stats(self):
+        """Return the request counters; handled requests that did not change the panel are not shown."""
+        return {
+            "submitted": self.submitted,
+            "superseded": self.superseded,
+            "handled": self.handled,
+            "shown": self.shown,
+        }
@@ -0,0 +1,49 @@
+import hashlib
+
+
+def frame_digest(frame):
+    """Return a short hash of a packed display buffer."""
+    return hashlib.blake2b(bytes(frame), digest_size=16).digest()
+
+
+class FrameCache:
+    """Remembers the frame currently shown on the panel.
+
+    The hash of the packed buffer decides whether a new frame differs from
+    the displayed one, so an unchanged screen can skip the whole
+    wake/transfer/sleep cycle.  The frame itself is kept as well, for
+    working out which regions changed.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.digest = None
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, frame):
+        """Return True if *frame* is the one on the panel, counting a hit or a miss."""
+        if self.digest is not None and frame_digest(frame) == self.digest:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def store(self, frame):
+        """Record *frame* as shown on the panel."""
+        self.frame = bytes(frame)
+        self.digest = frame_digest(self.frame)
+
+    def invalidate(self):
+        """Forget the panel content, e.g. after a clear or a failed refresh."""
+        self.frame = None
+        self.digest = None
+
+    def stats(self):
+        """Return the hit and miss counters."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
@@ -30,11 +30,40 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 80
 EPD_HEIGHT      = 128
 
+# Register scripts replayed by Init() and Partial_Init(), (command, data)
+INIT_SEQUENCE = (
+    (0xD2, [0x3F]),
+    (0x00, [0x6F]),
+    (0x01, [0x03, 0x00, 0x2B, 0x2B]),   # power setting
+    (0x06, [0x3F]),                     # Configuring the charge pump
+    (0x2A, [0x00, 0x00]),               # Setting XON and the options of LUT
+    (0x30, [0x17]),                     # Set the clock frequency
+    (0x50, [0x57]),                     # Set VCOM and data output interval
+    (0x60, [0x22]),                     # Set The non-overlapping period of Gate and Source.
+    (0x61, [0x50, 0x80]),               # resolution setting
+    (0x82, [0x12]),                     # sets VCOM_DC value
+    (0xE3, [0x33]),                     # Set POWER SAVING
+)
+
+PARTIAL_INIT_SEQUENCE = (
+    (0xD2, [0x3F]),
+    (0x00, [0x6F]),
+    (0x01, [0x03, 0x00, 0x2B, 0x2B]),   # power setting
+    (0x06, [0x3F]),                     # Configuring the charge pump
+    (0x2A, [0x00, 0x00]),               # Setting XON and the options of LUT
+    (0x30, [0x17]),                     # Set the clock frequency
+    (0x50, [0xF2]),                     # Set VCOM and data output interval
+    (0x60, [0x22]),                     # Set The non-overlapping period of Gate and Source.
+    (0x82, [0x12]),                     # Set VCOM_DC value
+    (0xE3, [0x33]),                     # Set POWER SAVING
+)
+
 logger = logging.getLogger(__name__)
 
 class EPD:
@@ -109,16 +138,20 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    # send a command with all of its data in one transaction
+    def send_command_data(self, command, data):
+        epdconfig.spi_transaction(command, data)
+
+    # replay a table of (command, data) register writes
+    def send_sequence(self, sequence):
+        for command, data in sequence:
+            epdconfig.spi_transaction(command, data)
         
     def ReadBusy(self):
         logger.debug("e-Paper busy")
         self.send_command(0x71)
-        busy = epdconfig.digital_read(self.busy_pin)
-        busy =not(busy & 0x01)
-        while(busy):
-            self.send_command(0x71)
-            busy = epdconfig.digital_read(self.busy_pin)
-            busy =not(busy & 0x01)
+        epdconfig.wait_busy(1)
         epdconfig.delay_ms(800)
         logger.debug("e-Paper busy release")        
 
@@ -128,22 +161,12 @@ class EPD:
         self.ReadBusy()
 
     def SetFulltReg(self):
-        self.send_command(0x23)
-        for count in range(0, 42):
-            self.send_data(self.lut_w1[count]) 
-        
-        self.send_command(0x24)
-        for count in range(0, 42):
-            self.send_data(self.lut_b1[count])     
+        self.send_command_data(0x23, self.lut_w1)
+        self.send_command_data(0x24, self.lut_b1)
 
     def SetPartReg(self):
-        self.send_command(0x23)
-        for count in range(0, 42):
-            self.send_data(self.lut_w[count]) 
-        
-        self.send_command(0x24)
-        for count in range(0, 42):
-            self.send_data(self.lut_b[count])     
+        self.send_command_data(0x23, self.lut_w)
+        self.send_command_data(0x24, self.lut_b)
 
     def Init(self):
         if (epdconfig.module_init() != 0):
@@ -151,43 +174,7 @@ class EPD:
         # EPD hardware init start
         self.reset()
         
-        self.send_command(0xD2)			
-        self.send_data(0x3F)
-
-        self.send_command(0x00)  			
-        self.send_data (0x6F)  #from outside
-
-        self.send_command(0x01)  #power setting
-        self.send_data (0x03)	    
-        self.send_data (0x00)
-        self.send_data (0x2b)		
-        self.send_data (0x2b) 
-
-        self.send_command(0x06)  #Configuring the charge pump
-        self.send_data(0x3f)
-
-        self.send_command(0x2A)  #Setting XON and the options of LUT
-        self.send_data(0x00) 
-        self.send_data(0x00) 
-
-        self.send_command(0x30)  #Set the clock frequency
-        self.send_data(0x17) #50Hz
-
-        self.send_command(0x50)  #Set VCOM and data output interval
-        self.send_data(0x57)			
-
-        self.send_command(0x60)  #Set The non-overlapping period of Gate and Source.
-        self.send_data(0x22)
-
-        self.send_command(0x61)  #resolution setting
-        self.send_data (0x50)    #source 128 	 
-        self.send_data (0x80)       
-
-        self.send_command(0x82)  #sets VCOM_DC value
-        self.send_data(0x12)  #-1v
-
-        self.send_command(0xe3)#Set POWER SAVING
-        self.send_data(0x33)
+        self.send_sequence(INIT_SEQUENCE)
         self.SetFulltReg()	
         self.send_command(0x04)     		#power on
         self.ReadBusy()
@@ -197,39 +184,7 @@ class EPD:
     def Partial_Init(self):
         self.reset()
         
-        self.send_command(0xD2)
-        self.send_data(0x3F)
-
-        self.send_command(0x00)
-        self.send_data (0x6F)  #from outside
-
-        self.send_command(0x01)  #power setting
-        self.send_data (0x03)
-        self.send_data (0x00)
-        self.send_data (0x2b)
-        self.send_data (0x2b)
-
-        self.send_command(0x06)  #Configuring the charge pump
-        self.send_data(0x3f)
-
-        self.send_command(0x2A)  #Setting XON and the options of LUT
-        self.send_data(0x00)
-        self.send_data(0x00)
-
-        self.send_command(0x30)  #Set the clock frequency
-        self.send_data(0x17)
-
-        self.send_command(0x50)  #Set VCOM and data output interval
-        self.send_data(0xf2)
-
-        self.send_command(0x60)  #Set The non-overlapping period of Gate and Source.
-        self.send_data(0x22)
-
-        self.send_command(0x82)  #Set VCOM_DC value
-        self.send_data(0x12)#-1v
-
-        self.send_command(0xe3)#Set POWER SAVING
-        self.send_data(0x33)
+        self.send_sequence(PARTIAL_INIT_SEQUENCE)
 
         self.SetPartReg()	
 
@@ -239,25 +194,10 @@ class EPD:
         return 0
     
     def getbuffer(self, image):
-        buf = [0xFF] * (int(self.width / 8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
+        buf = epdbuffer.pack_1bit(image, self.width, self.height)
+        if buf is None:
+            # image dimensions do not match the panel, return a blank buffer
+            return bytearray([0xFF]) * (int(self.width / 8) * self.height)
         return buf
 
     def display(self, image):
@@ -269,15 +209,8 @@ class EPD:
         else:
             Width = self.width // 8 + 1
             
-        self.send_command(0x10)
-        for j in range(0, self.height):
-            for i in range(0, int(Width)):
-                self.send_data(0xff)  
-        
-        self.send_command(0x13)
-        for j in range(0, self.height):
-            for i in range(0, int(Width)):
-                self.send_data(image[i + j * int(Width)])  
+        self.send_command_data(0x10, epdconfig.fill_buffer(0xff, self.height * int(Width)))
+        self.send_command_data(0x13, image[:self.height * int(Width)])
         self.TurnOnDisplay()
         
     def Clear(self):
@@ -289,28 +222,15 @@ class EPD:
             
         Height = self.height
         
-        self.send_command(0x10)
-        for j in range(0, Height):
-            for i in range(0, int(Width)):
-                self.send_data(0x00)  
-        
-        self.send_command(0x13)
-        for j in range(0, Height):
-            for i in range(0, int(Width)):
-                self.send_data(0xff)  
+        self.send_command_data(0x10, epdconfig.fill_buffer(0x00, Height * int(Width)))
+        self.send_command_data(0x13, epdconfig.fill_buffer(0xff, Height * int(Width)))
         self.TurnOnDisplay()
 
     def DisplayPartial(self, old_Image, Image):
 
         # Set partial Windows */
         self.send_command(0x91)		#This command makes the display enter partial mode
-        self.send_command(0x90)		#resolution setting
-        self.send_data(0)           #x-start
-        self.send_data(79)       #x-end
-
-        self.send_data(0)
-        self.send_data(127)  #y-end
-        self.send_data(0x00)
+        self.send_command_data(0x90, [0, 79, 0, 127, 0x00])     #resolution setting: x-start, x-end, y-start, y-end
        
         # Width = (self.width % 8 == 0)? (self.width // 8 ): (self.width // 8 + 1)
         if(self.width % 8 == 0):
@@ -320,15 +240,8 @@ class EPD:
             
         Height = self.height
         # send data
-        self.send_command(0x10)
-        for j in range(0, Height):
-            for i in range(0, int(Width)):
-                self.send_data(old_Image[i + j * int(Width)])
-
-        self.send_command(0x13)
-        for j in range(0, Height):
-            for i in range(0, int(Width)):
-                self.send_data(Image[i + j * int(Width)])
+        self.send_command_data(0x10, old_Image[:Height * int(Width)])
+        self.send_command_data(0x13, Image[:Height * int(Width)])
 
         # Set partial refresh
         self.TurnOnDisplay()
@@ -29,7 +29,9 @@
 
 
 import logging
+import numpy as np
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 122
@@ -113,8 +115,7 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 1)
         
     def ReadBusy(self):
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(100)    
+        epdconfig.wait_busy(0)      # 0: idle, 1: busy
 
     def TurnOnDisplay(self):
         self.send_command(0x22)
@@ -223,29 +224,19 @@ class EPD:
             linewidth = int(self.width/8)
         else:
             linewidth = int(self.width/8) + 1
-         
-        buf = [0xFF] * (linewidth * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):                    
-                    if pixels[x, y] == 0:
-                        x = imwidth - x
-                        buf[int(x / 8) + y * linewidth] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        newy = imwidth - newy - 1
-                        buf[int(newx / 8) + newy*linewidth] &= ~(0x80 >> (y % 8))
-        return buf   
+
+        img = epdbuffer.panel_image(image, self.width, self.height, '1')
+        if img is None:
+            # image dimensions do not match the panel, return a blank buffer
+            return bytearray([0xFF]) * (linewidth * self.height)
+
+        bits = np.ones((self.height, linewidth * 8), dtype=np.uint8)
+        if image.size == (self.width, self.height):
+            # the panel is mirrored horizontally and shifted by one column
+            bits[:, 1:self.width + 1] = np.asarray(img)[:, ::-1]
+        else:
+            bits[:, :self.width] = np.asarray(img)[::-1]
+        return epdbuffer.pack_pixels(bits, 1)
         
         
     def display(self, image):
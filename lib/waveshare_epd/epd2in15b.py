@@ -29,6 +29,7 @@
 
 import logging
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 160
@@ -78,8 +79,7 @@ class EPD:
     # judge e-Paper whether is busy
     def busy(self):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) != 0): 
-            epdconfig.delay_ms(10)
+        epdconfig.wait_busy(0)
         epdconfig.delay_ms(10)
         logger.debug("e-Paper busy release")
 
@@ -138,19 +138,12 @@ class EPD:
 
     # image converted to bytearray
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
-        else:
+        # image is rotated before the conversion, like PIL's rotate() used to do
+        buf = epdbuffer.pack_1bit(image, self.width, self.height, rotate_first=True, pad_white=False)
+        if buf is None:
             logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
             # return a blank buffer
             return [0x00] * (int(self.width/8) * self.height)
-
-        buf = bytearray(img.tobytes('raw'))
         return buf
 
     # display image
@@ -178,12 +171,12 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
             
-        buf = [0xff] * (int(linewidth * self.height))
+        buf = epdconfig.fill_buffer(0xff, int(linewidth * self.height))
             
         self.send_command(0x24)
         self.send_data2(buf)
         
-        buf = [0x00] * (int(linewidth * self.height))
+        buf = epdconfig.fill_buffer(0x00, int(linewidth * self.height))
         self.send_command(0x26)
         self.send_data2(buf)
         
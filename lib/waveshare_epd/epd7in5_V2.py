@@ -29,7 +29,11 @@
 
 
 import logging
+
+import numpy as np
+
 from . import epdconfig
+from . import epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 800
@@ -40,6 +44,54 @@ GRAY2  = 0xC0
 GRAY3  = 0x80 #gray
 GRAY4  = 0x00 #Blackest
 
+# Register scripts of the init modes, (command, data): the first table is
+# replayed before POWER ON, the *_POWERED one after it
+INIT_SEQUENCE = (
+    (0x06, [0x17, 0x17, 0x28, 0x17]),   # btst, if an exception is displayed, try 0x38 as the third byte
+    (0x01, [0x07, 0x07, 0x28, 0x17]),   # POWER SETTING: VGH=20V, VGL=-20V, VDH=15V, VDL=-15V
+)
+
+INIT_POWERED_SEQUENCE = (
+    (0x00, [0x1F]),                     # PANNEL SETTING: KW-3f KWR-2F BWROTP 0f BWOTP 1f
+    (0x61, [0x03, 0x20, 0x01, 0xE0]),   # tres: source 800, gate 480
+    (0x15, [0x00]),
+    # If the screen appears gray, use (0x50, [0x10, 0x17]), (0x52, [0x03]) instead
+    (0x50, [0x10, 0x07]),
+    (0x60, [0x22]),                     # TCON SETTING
+)
+
+FAST_SEQUENCE = (
+    (0x00, [0x1F]),                     # PANNEL SETTING: KW-3f KWR-2F BWROTP 0f BWOTP 1f
+    # If the screen appears gray, use (0x50, [0x10, 0x17]), (0x52, [0x03]) instead
+    (0x50, [0x10, 0x07]),
+)
+
+FAST_POWERED_SEQUENCE = (
+    (0x06, [0x27, 0x27, 0x18, 0x17]),   # Booster Soft Start, enhanced display drive
+    (0xE0, [0x02]),
+    (0xE5, [0x5A]),
+)
+
+PART_SEQUENCE = (
+    (0x00, [0x1F]),                     # PANNEL SETTING: KW-3f KWR-2F BWROTP 0f BWOTP 1f
+)
+
+PART_POWERED_SEQUENCE = (
+    (0xE0, [0x02]),
+    (0xE5, [0x6E]),
+)
+
+GRAY4_SEQUENCE = (
+    (0x00, [0x1F]),                     # PANNEL SETTING: KW-3f KWR-2F BWROTP 0f BWOTP 1f
+    (0x50, [0x10, 0x07]),
+)
+
+GRAY4_POWERED_SEQUENCE = (
+    (0x06, [0x27, 0x27, 0x18, 0x17]),   # Booster Soft Start, enhanced display drive
+    (0xE0, [0x02]),
+    (0xE5, [0x5F]),
+)
+
 logger = logging.getLogger(__name__)
 
 class EPD:
@@ -54,9 +106,15 @@ class EPD:
         self.GRAY2  = GRAY2
         self.GRAY3  = GRAY3 #gray
         self.GRAY4  = GRAY4 #Blackest
+        # inverted copy of the frame for the old data RAM, reused every refresh
+        self.inverted = np.empty(int(self.width / 8) * self.height, dtype=np.uint8)
+        # mode the controller was last initialised in: "full", "fast", "part",
+        # "4gray", or None while it sleeps
+        self.mode = None
     
     # Hardware reset
     def reset(self):
+        self.mode = None
         epdconfig.digital_write(self.reset_pin, 1)
         epdconfig.delay_ms(20) 
         epdconfig.digital_write(self.reset_pin, 0)
@@ -79,248 +137,114 @@ class EPD:
     def send_data2(self, data):
         epdconfig.digital_write(self.dc_pin, 1)
         epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.SPI.writebytes2(data)
+        epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
 
+    # send a command with all of its data in one transaction
+    def send_command_data(self, command, data):
+        epdconfig.spi_transaction(command, data)
+
+    # replay a table of (command, data) register writes
+    def send_sequence(self, sequence):
+        for command, data in sequence:
+            epdconfig.spi_transaction(command, data)
+
     def ReadBusy(self):
         logger.debug("e-Paper busy")
-        self.send_command(0x71)
-        busy = epdconfig.digital_read(self.busy_pin)
-        while(busy == 0):
+        # the controller updates BUSY only after a GET STATUS (0x71), so
+        # send it again before every read of the pin
+        def idle():
             self.send_command(0x71)
-            busy = epdconfig.digital_read(self.busy_pin)
+            return epdconfig.digital_read(self.busy_pin)
+        epdconfig.wait_busy_polled(idle, 1)
         epdconfig.delay_ms(20)
         logger.debug("e-Paper busy release")
+
+    # Starts the refresh of the frame in RAM. With wait=False it returns as
+    # soon as the refresh is started, the caller must then ReadBusy() before
+    # sending the next command (see epdasync.DisplayWorker)
+    def TurnOnDisplay(self, wait=True):
+        self.send_command(0x12)
+        epdconfig.delay_ms(100)
+        if wait:
+            self.ReadBusy()
         
-    def init(self):
+    # reset, replay *sequence*, POWER ON, then replay *powered_sequence*
+    def init_mode(self, mode, sequence, powered_sequence):
         if (epdconfig.module_init() != 0):
             return -1
         # EPD hardware init start
         self.reset()
-        
-        self.send_command(0x06)     # btst
-        self.send_data(0x17)
-        self.send_data(0x17)
-        self.send_data(0x28)        # If an exception is displayed, try using 0x38
-        self.send_data(0x17)
-        
-        self.send_command(0x01)			#POWER SETTING
-        self.send_data(0x07)
-        self.send_data(0x07)    #VGH=20V,VGL=-20V
-        self.send_data(0x28)		#VDH=15V
-        self.send_data(0x17)		#VDL=-15V
+
+        self.send_sequence(sequence)
 
         self.send_command(0x04) #POWER ON
         epdconfig.delay_ms(100)
-        self.ReadBusy()
-
-        self.send_command(0X00)			#PANNEL SETTING
-        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
-
-        self.send_command(0x61)        	#tres
-        self.send_data(0x03)		#source 800
-        self.send_data(0x20)
-        self.send_data(0x01)		#gate 480
-        self.send_data(0xE0)
-
-        self.send_command(0X15)
-        self.send_data(0x00)
-
-        # If the screen appears gray, use the annotated initialization command
-        self.send_command(0X50)
-        self.send_data(0x10)
-        self.send_data(0x07)
-        # self.send_command(0X50)
-        # self.send_data(0x10)
-        # self.send_data(0x17)
-        # self.send_command(0X52)		
-        # self.send_data(0x03)
+        self.ReadBusy()        #waiting for the electronic paper IC to release the idle signal
 
-        self.send_command(0X60)			#TCON SETTING
-        self.send_data(0x22)
+        self.send_sequence(powered_sequence)
 
         # EPD hardware init end
+        self.mode = mode
         return 0
+
+    def init(self):
+        return self.init_mode("full", INIT_SEQUENCE, INIT_POWERED_SEQUENCE)
     
     def init_fast(self):
-        if (epdconfig.module_init() != 0):
-            return -1
-        # EPD hardware init start
-        self.reset()
-        
-        self.send_command(0X00)			#PANNEL SETTING
-        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
-
-        # If the screen appears gray, use the annotated initialization command
-        self.send_command(0X50)
-        self.send_data(0x10)
-        self.send_data(0x07)
-        # self.send_command(0X50)
-        # self.send_data(0x10)
-        # self.send_data(0x17)
-        # self.send_command(0X52)		
-        # self.send_data(0x03)
-
-        self.send_command(0x04) #POWER ON
-        epdconfig.delay_ms(100) 
-        self.ReadBusy()        #waiting for the electronic paper IC to release the idle signal
-
-        #Enhanced display drive(Add 0x06 command)
-        self.send_command(0x06)			#Booster Soft Start 
-        self.send_data (0x27)
-        self.send_data (0x27)   
-        self.send_data (0x18)		
-        self.send_data (0x17)		
-
-        self.send_command(0xE0)
-        self.send_data(0x02)
-        self.send_command(0xE5)
-        self.send_data(0x5A)
-
-        # EPD hardware init end
-        return 0
+        return self.init_mode("fast", FAST_SEQUENCE, FAST_POWERED_SEQUENCE)
     
     def init_part(self):
-        if (epdconfig.module_init() != 0):
-            return -1
-        # EPD hardware init start
-        self.reset()
-
-        self.send_command(0X00)			#PANNEL SETTING
-        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
-
-        self.send_command(0x04) #POWER ON
-        epdconfig.delay_ms(100) 
-        self.ReadBusy()        #waiting for the electronic paper IC to release the idle signal
-
-        self.send_command(0xE0)
-        self.send_data(0x02)
-        self.send_command(0xE5)
-        self.send_data(0x6E)
-
-        # EPD hardware init end
-        return 0
+        return self.init_mode("part", PART_SEQUENCE, PART_POWERED_SEQUENCE)
     
+    # Keeps SPI open and the panel in partial mode between quick updates,
+    # instead of a reset and POWER ON for every one of them
+    def init_part_session(self):
+        if self.mode == "part":
+            return 0
+        return self.init_part()
+
     # The feature will only be available on screens sold after 24/10/23
     def init_4Gray(self):
-        if (epdconfig.module_init() != 0):
-            return -1
-        # EPD hardware init start
-        self.reset()
-
-        self.send_command(0X00)			#PANNEL SETTING
-        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
-        
-        self.send_command(0X50)
-        self.send_data(0x10)
-        self.send_data(0x07)
-
-        self.send_command(0x04) #POWER ON
-        epdconfig.delay_ms(100) 
-        self.ReadBusy()        #waiting for the electronic paper IC to release the idle signal
-
-        #Enhanced display drive(Add 0x06 command)
-        self.send_command(0x06)			#Booster Soft Start 
-        self.send_data (0x27)
-        self.send_data (0x27)   
-        self.send_data (0x18)		
-        self.send_data (0x17)	
-
-        self.send_command(0xE0)
-        self.send_data(0x02)
-        self.send_command(0xE5)
-        self.send_data(0x5F)
-
-        # EPD hardware init end
-        return 0
+        return self.init_mode("4gray", GRAY4_SEQUENCE, GRAY4_POWERED_SEQUENCE)
 
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
-        else:
+        # The bytes need to be inverted, because in the PIL world 0=black and 1=white, but
+        # in the e-paper world 0=white and 1=black.
+        buf = epdbuffer.pack_1bit(image, self.width, self.height, rotate_first=True, invert=True)
+        if buf is None:
             logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
             # return a blank buffer
             return [0x00] * (int(self.width/8) * self.height)
-
-        buf = bytearray(img.tobytes('raw'))
-        # The bytes need to be inverted, because in the PIL world 0=black and 1=white, but
-        # in the e-paper world 0=white and 1=black.
-        for i in range(len(buf)):
-            buf[i] ^= 0xFF
         return buf
     
     def getbuffer_4Gray(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width / 4) * self.height)
-        image_monocolor = image.convert('L')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        i=0
-        # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if(pixels[x, y] == 0xC0):
-                        pixels[x, y] = 0x80
-                    elif (pixels[x, y] == 0x80):
-                        pixels[x, y] = 0x40
-                    i= i+1
-                    if(i%4 == 0):
-                        buf[int((x + (y * self.width))/4)] = ((pixels[x-3, y]&0xc0) | (pixels[x-2, y]&0xc0)>>2 | (pixels[x-1, y]&0xc0)>>4 | (pixels[x, y]&0xc0)>>6)
-                        
-        elif(imwidth == self.height and imheight == self.width):
-            logger.debug("Horizontal")
-            for x in range(imwidth):
-                for y in range(imheight):
-                    newx = y
-                    newy = self.height - x - 1
-                    if(pixels[x, y] == 0xC0):
-                        pixels[x, y] = 0x80
-                    elif (pixels[x, y] == 0x80):
-                        pixels[x, y] = 0x40
-                    i= i+1
-                    if(i%4 == 0):
-                        buf[int((newx + (newy * self.width))/4)] = ((pixels[x, y-3]&0xc0) | (pixels[x, y-2]&0xc0)>>2 | (pixels[x, y-1]&0xc0)>>4 | (pixels[x, y]&0xc0)>>6) 
+        buf = epdbuffer.pack_4gray(image, self.width, self.height)
+        if buf is None:
+            # image dimensions do not match the panel, return a blank buffer
+            return [0xFF] * (int(self.width / 4) * self.height)
         return buf
 
-    def display(self, image):
-        if(self.width % 8 == 0):
-            Width = self.width // 8
-        else:
-            Width = self.width // 8 +1
-        Height = self.height
-        image1 = [0xFF] * int(self.width * self.height / 8)
-        for j in range(Height):
-                for i in range(Width):
-                    image1[i + j * Width] = ~image[i + j * Width]
+    def display(self, image, wait=True):
+        image = epdbuffer.as_array(image)
+        # memoryviews, so every backend gets a plain bytes-like object
         self.send_command(0x10)
-        self.send_data2(image1)
+        self.send_data2(memoryview(np.bitwise_not(image, out=self.inverted)))
 
         self.send_command(0x13)
-        self.send_data2(image)
+        self.send_data2(memoryview(image))
 
-        self.send_command(0x12)
-        epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.TurnOnDisplay(wait)
 
-    def Clear(self):
+    def Clear(self, wait=True):
         self.send_command(0x10)
-        self.send_data2([0xFF] * int(self.width * self.height / 8))
+        self.send_data2(epdconfig.fill_buffer(0xFF, int(self.width * self.height / 8)))
         self.send_command(0x13)
-        self.send_data2([0x00] * int(self.width * self.height / 8))
+        self.send_data2(epdconfig.fill_buffer(0x00, int(self.width * self.height / 8)))
 
-        self.send_command(0x12)
-        epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.TurnOnDisplay(wait)
 
-    def display_Partial(self, Image, Xstart, Ystart, Xend, Yend):
+    def display_Partial(self, Image, Xstart, Ystart, Xend, Yend, wait=True):
         if((Xstart % 8 + Xend % 8 == 8 & Xstart % 8 > Xend % 8) | Xstart % 8 + Xend % 8 == 0 | (Xend - Xstart)%8 == 0):
             Xstart = Xstart // 8 * 8
             Xend = Xend // 8 * 8
@@ -334,116 +258,42 @@ class EPD:
         Width = (Xend - Xstart) // 8
         Height = Yend - Ystart
 	
-        self.send_command(0x50)
-        self.send_data(0xA9)
-        self.send_data(0x07)
+        self.send_command_data(0x50, [0xA9, 0x07])
 
         self.send_command(0x91)		#This command makes the display enter partial mode
-        self.send_command(0x90)		#resolution setting
-        self.send_data (Xstart//256)
-        self.send_data (Xstart%256)   #x-start    
-
-        self.send_data ((Xend-1)//256)		
-        self.send_data ((Xend-1)%256)  #x-end	
-
-        self.send_data (Ystart//256)  #
-        self.send_data (Ystart%256)   #y-start    
-
-        self.send_data ((Yend-1)//256)		
-        self.send_data ((Yend-1)%256)  #y-end
-        self.send_data (0x01)
+        self.send_command_data(0x90, [Xstart//256, Xstart%256,         #x-start
+                                      (Xend-1)//256, (Xend-1)%256,       #x-end
+                                      Ystart//256, Ystart%256,           #y-start
+                                      (Yend-1)//256, (Yend-1)%256,       #y-end
+                                      0x01])                             #resolution setting
 
-        image1 = [0xFF] * int(self.width * self.height / 8)
-        for j in range(Height):
-                for i in range(Width):
-                    image1[i + j * Width] = ~Image[i + j * Width]
+        # Image holds just the window, Width bytes per row
+        window = epdbuffer.as_array(Image)[:Width * Height]
 
         self.send_command(0x13)   #Write Black and White image to RAM
-        self.send_data2(image1)
+        self.send_data2(memoryview(np.bitwise_not(window, out=self.inverted[:window.size])))
 
-        self.send_command(0x12)
-        epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.TurnOnDisplay(wait)
 
-    def display_4Gray(self, image):
+    def display_4Gray(self, image, wait=True):
+        # RAM plane bits of the black, gray2, gray1 and white pixels
         self.send_command(0x10)
-        for i in range(0, 48000):     
-            temp3=0
-            for j in range(0, 2):
-                temp1 = image[i*2+j]
-                for k in range(0, 2):
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00):
-                        temp3 |= 0x01  
-                    elif(temp2 == 0x80): 
-                        temp3 |= 0x01 
-                    else: #0x40
-                        temp3 |= 0x00 
-                    temp3 <<= 1	
-                    
-                    temp1 <<= 2
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0): 
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00): 
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x01
-                    else :   #0x40
-                        temp3 |= 0x00	
-                    if(j!=1 or k!=1):				
-                        temp3 <<= 1
-                    temp1 <<= 2
-            self.send_data(temp3)
-            
-        self.send_command(0x13)	       
-        for i in range(0, 48000):       
-            temp3=0
-            for j in range(0, 2):
-                temp1 = image[i*2+j]
-                for k in range(0, 2):
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00):
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x00
-                    else: #0x40
-                        temp3 |= 0x01 
-                    temp3 <<= 1	
-                    
-                    temp1 <<= 2
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0): 
-                        temp3 |= 0x00
-                    elif(temp2 == 0x00): 
-                        temp3 |= 0x01
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x00 
-                    else:    #0x40
-                            temp3 |= 0x01	
-                    if(j!=1 or k!=1):					
-                        temp3 <<= 1
-                    temp1 <<= 2
-            self.send_data(temp3)
-        
-        self.send_command(0x12)
-        epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.send_data2(epdbuffer.split_4gray(image, (1, 0, 1, 0)))
+
+        self.send_command(0x13)
+        self.send_data2(epdbuffer.split_4gray(image, (1, 1, 0, 0)))
+
+        self.TurnOnDisplay(wait)
 
     def sleep(self):
-        self.send_command(0x50)
-        self.send_data(0XF7)
+        self.send_command_data(0x50, [0xF7])
         
         self.send_command(0x02) # POWER_OFF
         self.ReadBusy()
         
-        self.send_command(0x07) # DEEP_SLEEP
-        self.send_data(0XA5)
+        self.send_command_data(0x07, [0xA5])  # DEEP_SLEEP
         
         epdconfig.delay_ms(2000)
         epdconfig.module_exit()
+        self.mode = None
 ### END OF FILE ###
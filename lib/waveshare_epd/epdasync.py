@@ -0,0 +1,167 @@
+# *****************************************************************************
+# * | File        :	  epdasync.py
+# * | Function    :   Non-blocking display jobs for the e-paper drivers
+# * | Info        :
+# *----------------
+# * | Info        :   Runs the transfers and BUSY waits of one panel on a
+# *                   dedicated thread, coalescing frames that arrive while
+# *                   the panel is refreshing
+# ******************************************************************************
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documnetation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to  whom the Software is
+# furished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS OR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import concurrent.futures
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DisplayFuture(concurrent.futures.Future):
+    """Future of a display job; transferred is set once its data is on the wire.
+
+    Use asyncio.wrap_future() to await it from a coroutine.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.transferred = threading.Event()
+
+
+class DisplayWorker:
+    """Runs the display jobs of one panel on a dedicated thread.
+
+    submit() returns a DisplayFuture at once, the job (any callable driving
+    the panel) then runs on the worker, BUSY waits included, so the caller is
+    never blocked by a refresh.  There is a single pending slot: a job
+    submitted while another one waits replaces it and the replaced future is
+    cancelled, so frames arriving faster than the panel refreshes coalesce
+    into the latest one.  With idle_timeout, on_idle is called on the worker
+    once the panel has not been driven for that many seconds, e.g. to put it
+    to sleep.  A job counts as driving the panel when it marks its data as
+    transferred (see display() and transferred()); jobs that leave the panel
+    alone, like a skipped unchanged frame, do not delay on_idle.
+    """
+
+    def __init__(self, epd, idle_timeout=None, on_idle=None, name="epd-display"):
+        self.epd = epd
+        self.idle_timeout = idle_timeout
+        self.on_idle = on_idle
+        self.condition = threading.Condition()
+        self.pending = None
+        self.current = None
+        self.closed = False
+        self.submitted = 0
+        self.superseded = 0
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) to run on the worker, replacing the pending job."""
+        future = DisplayFuture()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("display worker is closed")
+            if self.pending is not None and self.pending[0].cancel():
+                self.superseded += 1
+            self.pending = (future, fn, args, kwargs)
+            self.submitted += 1
+            self.condition.notify()
+        return future
+
+    def display(self, method, *args, **kwargs):
+        """Queue a driver display method, e.g. worker.display(epd.display, buf).
+
+        The method runs with wait=False, so the future is marked transferred
+        as soon as the refresh has started; the worker then waits for BUSY.
+        """
+        return self.submit(self._display, method, args, kwargs)
+
+    def _display(self, method, args, kwargs):
+        result = method(*args, wait=False, **kwargs)
+        self.transferred()
+        self.epd.ReadBusy()
+        return result
+
+    def transferred(self):
+        """Mark the data of the running job as sent, for jobs that wait for BUSY themselves."""
+        future = self.current
+        if future is not None:
+            future.transferred.set()
+
+    def next_job(self, idle_since):
+        """Return the next job, or None when the worker is closed or has become idle."""
+        with self.condition:
+            while self.pending is None and not self.closed:
+                timeout = None
+                if idle_since is not None:
+                    timeout = idle_since + self.idle_timeout - time.monotonic()
+                    if timeout <= 0:
+                        return None
+                self.condition.wait(timeout)
+            job, self.pending = self.pending, None
+            return job
+
+    def run(self):
+        idle_since = None
+        while True:
+            job = self.next_job(idle_since if self.idle_timeout and self.on_idle else None)
+            if job is None:
+                if self.closed:
+                    return
+                idle_since = None
+                try:
+                    self.on_idle()
+                except Exception as e:
+                    logger.error("Display idle handler failed: %s", e)
+                continue
+
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.current = future
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                self.current = None
+                # only a job that sent data to the panel restarts the idle
+                # timer; skipped frames must not keep the panel powered
+                if future.transferred.is_set():
+                    idle_since = time.monotonic()
+                future.transferred.set()
+
+    def close(self, timeout=None):
+        """Cancel the pending job, wait for the running one and stop the worker."""
+        with self.condition:
+            self.closed = True
+            if self.pending is not None:
+                self.pending[0].cancel()
+                self.pending = None
+            self.condition.notify()
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        """Return the number of submitted and superseded jobs."""
+        return {"submitted": self.submitted, "superseded": self.superseded}
@@ -0,0 +1,189 @@
+# *****************************************************************************
+# * | File        :	  epdbuffer.py
+# * | Function    :   Shared frame buffer packing for the e-paper drivers
+# * | Info        :
+# *----------------
+# * | Info        :   Replaces the per-pixel getbuffer loops of the drivers
+# *                   with PIL/NumPy bulk operations producing identical bytes
+# ******************************************************************************
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documnetation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to  whom the Software is
+# furished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS OR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import functools
+import logging
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 2 bit gray level of every 8 bit luminance value, as the 4 gray drivers
+# compute it: 0xC0 is moved down to 0x80 and 0x80 to 0x40 before the two
+# top bits are taken, so GRAY1..GRAY4 end up as 3, 2, 1 and 0.
+GRAY4_LUT = np.array([(v & 0xC0) >> 6 for v in range(256)], dtype=np.uint8)
+GRAY4_LUT[0xC0] = 0x80 >> 6
+GRAY4_LUT[0x80] = 0x40 >> 6
+
+
+def panel_image(image, width, height, mode, rotate_first=False, method=Image.ROTATE_90):
+    """Return *image* converted to *mode* in panel orientation.
+
+    Landscape input (``width`` x ``height``) is only converted, portrait input
+    (``height`` x ``width``) is additionally transposed with ``method``
+    (rotated by 90 degrees by default).  The old pixel loops converted first
+    and rotated while packing, the PIL based drivers rotated first; since
+    dithering is not rotation invariant both orders are kept
+    (``rotate_first``).  Returns None for any other size.
+    """
+    imwidth, imheight = image.size
+    if imwidth == width and imheight == height:
+        return image.convert(mode)
+    if imwidth == height and imheight == width:
+        if rotate_first:
+            return image.transpose(method).convert(mode)
+        return image.convert(mode).transpose(method)
+    return None
+
+
+def pack_1bit(image, width, height, rotate_first=False, invert=False, pad_white=True):
+    """Pack *image* into a 1 bit per pixel, MSB first panel buffer.
+
+    Bits are 1 for white and 0 for black (or the other way round with
+    ``invert``), rows are padded to whole bytes.  ``pad_white`` sets the
+    padding bits the way the pixel loops did (they started from 0xFF),
+    otherwise PIL's zero padding is kept.  Returns a bytearray, or None when
+    the image size matches neither orientation.
+    """
+    img = panel_image(image, width, height, '1', rotate_first)
+    if img is None:
+        return None
+    buf = bytearray(img.tobytes('raw', '1;I' if invert else '1'))
+    if pad_white and not invert and width % 8:
+        rows = np.frombuffer(buf, dtype=np.uint8).reshape(height, -1)
+        rows[:, -1] |= 0xFF >> (width % 8)
+    return buf
+
+
+def pack_pixels(values, bits):
+    """Pack a 2D array of small pixel values into a bytearray, MSB first.
+
+    ``bits`` is the pixel depth (1, 2 or 4).  The pixels are taken as one
+    continuous stream, so each row must hold a whole number of bytes.
+    """
+    per_byte = 8 // bits
+    values = np.asarray(values, dtype=np.uint8).reshape(-1, per_byte)
+    packed = np.zeros(values.shape[0], dtype=np.uint8)
+    for i in range(per_byte):
+        packed |= values[:, i] << (8 - bits * (i + 1))
+    return bytearray(packed.tobytes())
+
+
+def expand_1bit(image, width, height, bits, white, rotate_first=False):
+    """Convert *image* to 1 bit and store it with ``bits`` bits per pixel.
+
+    White pixels get the value ``white`` and black pixels 0, which is what the
+    2 and 4 bit black/white drivers send.  Returns None on a size mismatch.
+    """
+    img = panel_image(image, width, height, '1', rotate_first)
+    if img is None:
+        return None
+    values = np.asarray(img, dtype=np.uint8) * white
+    return pack_pixels(values, bits)
+
+
+def pack_4gray(image, width, height, method=Image.ROTATE_90):
+    """Pack *image* into a 2 bit per pixel 4 gray buffer (see GRAY4_LUT).
+
+    Returns a bytearray, or None when the image size matches neither
+    orientation.
+    """
+    img = panel_image(image, width, height, 'L', method=method)
+    if img is None:
+        return None
+    return pack_pixels(GRAY4_LUT[np.asarray(img)], 2)
+
+
+def as_array(buf):
+    """View a frame buffer (bytes-like object or list of ints) as a uint8 array."""
+    if isinstance(buf, (bytes, bytearray, memoryview)):
+        return np.frombuffer(buf, dtype=np.uint8)
+    return np.asarray(buf, dtype=np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def _plane_table(levels):
+    """256 entry table from one 4 gray byte (4 pixels) to its 4 RAM plane bits."""
+    table = np.zeros(256, dtype=np.uint8)
+    for byte in range(256):
+        for i in range(4):
+            table[byte] |= levels[(byte >> (6 - 2 * i)) & 3] << (3 - i)
+    return table
+
+
+def split_4gray(buf, levels):
+    """Return one controller RAM plane of a pack_4gray buffer as a bytearray.
+
+    The 4 gray controllers take a gray frame as two 1 bit planes; ``levels``
+    gives the bit written to this plane for the gray values 0 to 3 (black,
+    gray2, gray1, white).  Every two input bytes make one plane byte.
+    """
+    table = _plane_table(tuple(levels))
+    data = as_array(buf)
+    plane = (table[data[0::2]] << 4) | table[data[1::2]]
+    return bytearray(plane.tobytes())
+
+
+def _frame(buf, width, height):
+    """View a packed 1 bit frame as a (height, bytes per row) array."""
+    stride = (width + 7) // 8
+    return as_array(buf)[:stride * height].reshape(height, stride)
+
+
+def dirty_windows(previous, current, width, height, gap=8, max_windows=4):
+    """Return the windows where two packed 1 bit frames differ.
+
+    Changed rows are grouped into bands, rows less than ``gap`` apart joining
+    the same band, and each band is narrowed to the bytes that changed.  The
+    windows are ``(xstart, ystart, xend, yend)`` pixel tuples with exclusive
+    ends and x aligned to 8 pixels, as display_Partial takes them.  More than
+    ``max_windows`` bands are merged into one window, since every window
+    costs a refresh.  Returns an empty list when the frames are equal.
+    """
+    diff = _frame(previous, width, height) != _frame(current, width, height)
+    rows = np.flatnonzero(diff.any(axis=1))
+    if not rows.size:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) > gap)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+    if len(starts) > max_windows:
+        starts, ends = starts[:1], ends[-1:]
+    windows = []
+    for ystart, yend in zip(starts, ends):
+        cols = np.flatnonzero(diff[ystart:yend].any(axis=0))
+        windows.append((int(cols[0]) * 8, int(ystart), (int(cols[-1]) + 1) * 8, int(yend)))
+    return windows
+
+
+def crop_window(buf, width, height, window):
+    """Return the bytes of a byte aligned window of a packed 1 bit frame."""
+    xstart, ystart, xend, yend = window
+    return _frame(buf, width, height)[ystart:yend, xstart // 8:xend // 8].tobytes()
+
+### END OF FILE ###
@@ -0,0 +1,144 @@
+# *****************************************************************************
+# * | File        :	  epdcolor.py
+# * | Function    :   Palette conversion for the colour e-paper drivers
+# * | Info        :
+# *----------------
+# * | Info        :   Cached palettes, palette quantization and packing of the
+# *                   palette indices into 2 or 4 bit per pixel panel buffers
+# ******************************************************************************
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documnetation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to  whom the Software is
+# furished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS OR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+import functools
+import logging
+
+import numpy as np
+from PIL import Image
+
+from . import epdbuffer
+
+logger = logging.getLogger(__name__)
+
+# Panel palettes, (r, g, b) per palette index as the controllers number them
+PALETTE_7COLOR = (            # epd5in65f, epd7in3f, epd4in01f
+    (0, 0, 0), (255, 255, 255), (0, 255, 0), (0, 0, 255),
+    (255, 0, 0), (255, 255, 0), (255, 128, 0),
+)
+PALETTE_6COLOR = (            # epd7in3e, index 4 is not used
+    (0, 0, 0), (255, 255, 255), (255, 255, 0), (255, 0, 0),
+    (0, 0, 0), (0, 0, 255), (0, 255, 0),
+)
+PALETTE_4COLOR = (            # the *g drivers
+    (0, 0, 0), (255, 255, 255), (255, 255, 0), (255, 0, 0),
+)
+
+
+@functools.lru_cache(maxsize=None)
+def palette_image(palette):
+    """Return a cached "P" image carrying *palette*, for Image.quantize."""
+    pal_image = Image.new("P", (1, 1))
+    pal_image.putpalette(sum(palette, ()) + (0, 0, 0) * (256 - len(palette)))
+    return pal_image
+
+
+@functools.lru_cache(maxsize=None)
+def rgb_lut(palette, bits=5):
+    """Return a 3D lookup table from RGB to the nearest palette index.
+
+    Each channel is cut to its top ``bits`` bits, so the table has
+    ``2 ** (3 * bits)`` entries (32 KiB for 5 bits); every cell maps to the
+    palette color closest to its center.  Built once per palette.
+    """
+    levels = 1 << bits
+    centers = (np.arange(levels) << (8 - bits)) + (1 << (7 - bits))
+    colors = np.array(palette, dtype=np.int32)
+    best = np.zeros((levels, levels, levels), dtype=np.uint8)
+    best_dist = np.full((levels, levels, levels), np.iinfo(np.int32).max)
+    r, g, b = np.meshgrid(centers, centers, centers, indexing='ij')
+    # the first of equally close (or duplicate) colors wins, as with PIL
+    for i, (cr, cg, cb) in enumerate(colors):
+        dist = (r - cr) ** 2 + (g - cg) ** 2 + (b - cb) ** 2
+        closer = dist < best_dist
+        best[closer] = i
+        best_dist[closer] = dist[closer]
+    return best
+
+
+def quantize(image, width, height, palette, dither=True, lut_bits=None):
+    """Map *image* to palette indices, as a (height, width) uint8 array.
+
+    By default PIL quantizes with Floyd-Steinberg dithering, like the
+    drivers always did; ``dither=False`` maps every pixel to the nearest
+    color.  With ``lut_bits`` the non-dithered mapping goes through the
+    cached rgb_lut instead of PIL, which is faster on large frames.  Portrait
+    images are rotated by 90 degrees first.  Returns None when the image
+    size matches neither orientation.
+    """
+    img = epdbuffer.panel_image(image, width, height, 'RGB', rotate_first=True)
+    if img is None:
+        return None
+    if lut_bits and not dither:
+        rgb = np.asarray(img) >> (8 - lut_bits)
+        return rgb_lut(palette, lut_bits)[rgb[..., 0], rgb[..., 1], rgb[..., 2]]
+    method = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+    return np.asarray(img.quantize(palette=palette_image(palette), dither=method))
+
+
+def exact_indices(image, width, height, palette):
+    """Map the pixels of *image* that exactly match a palette color to its index.
+
+    Pixels of any other color get index 0.  Returns None on a size mismatch.
+    """
+    img = epdbuffer.panel_image(image, width, height, 'RGB')
+    if img is None:
+        return None
+    rgb = np.asarray(img, dtype=np.uint32)
+    keys = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+    indices = np.zeros(keys.shape, dtype=np.uint8)
+    for i in reversed(range(len(palette))):
+        r, g, b = palette[i]
+        indices[keys == ((r << 16) | (g << 8) | b)] = i
+    return indices
+
+
+def pack_indices(indices, bits):
+    """Pack a (height, width) array of palette indices, ``bits`` per pixel.
+
+    Rows are padded with index 0 to whole bytes.  Returns a bytearray.
+    """
+    per_byte = 8 // bits
+    pad = -indices.shape[1] % per_byte
+    if pad:
+        indices = np.pad(indices, ((0, 0), (0, pad)))
+    return epdbuffer.pack_pixels(indices, bits)
+
+
+def pack_palette(image, width, height, palette, bits, dither=True, lut_bits=None):
+    """Quantize *image* to *palette* and pack it, see quantize and pack_indices.
+
+    Returns a bytearray, or None when the image size matches neither
+    orientation.
+    """
+    indices = quantize(image, width, height, palette, dither, lut_bits)
+    if indices is None:
+        return None
+    return pack_indices(indices, bits)
+
+### END OF FILE ###
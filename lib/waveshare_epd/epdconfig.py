@@ -28,6 +28,7 @@
 #
 
 import os
+import collections
 import logging
 import sys
 import time
@@ -37,6 +38,126 @@ from ctypes import *
 
 logger = logging.getLogger(__name__)
 
+_fill_buffers = {}
+
+
+def fill_buffer(value, length):
+    """Return a shared, read-only buffer of *length* bytes set to *value*.
+
+    Clear() and friends send the same constant frames over and over; this
+    keeps one bytes object per (value, length) instead of building a new list
+    every time.
+    """
+    key = (value & 0xFF, length)
+    buf = _fill_buffers.get(key)
+    if buf is None:
+        buf = _fill_buffers[key] = bytes([value & 0xFF]) * length
+    return buf
+
+
+# Longest time the drivers wait for the panel to release BUSY, in seconds.
+# A colour panel refresh takes up to ~35 s; an unplugged or dead panel would
+# otherwise keep the caller waiting forever.
+BUSY_TIMEOUT = 60
+
+# Upper bound of the poll interval when BUSY is polled, in seconds
+BUSY_POLL_MAX = 0.05
+
+
+class BusyTimeoutError(TimeoutError):
+    """The BUSY pin did not reach the idle level within the timeout."""
+
+
+def poll_busy(read, level, timeout):
+    """Wait until read() returns *level*, polling with an increasing interval.
+
+    Used by the backends that have no edge events.  The interval starts at
+    1 ms, so short waits return quickly, and doubles up to BUSY_POLL_MAX so a
+    long refresh does not keep a core busy.
+    """
+    deadline = time.monotonic() + timeout
+    interval = 0.001
+    while read() != level:
+        if time.monotonic() >= deadline:
+            raise BusyTimeoutError("e-Paper BUSY pin not %d after %.1f s" % (level, timeout))
+        time.sleep(interval)
+        interval = min(interval * 2, BUSY_POLL_MAX)
+
+
+# Totals of the backend calls since the module was loaded, for profiling:
+# "<group>_calls" and "<group>_seconds" for the groups in TIMED_CALLS, and
+# "spi_bytes".  Cheap enough to stay on; take the difference of two snapshots
+# (dict(stats)) to see what one refresh cost.
+stats = collections.Counter()
+
+# Backend functions counted in stats, by group
+TIMED_CALLS = {
+    'spi_writebyte': 'spi',
+    'spi_writebyte2': 'spi',
+    'spi_transaction': 'spi',
+    'DEV_SPI_write': 'spi',
+    'DEV_SPI_nwrite': 'spi',
+    'wait_busy': 'busy',
+    'delay_ms': 'delay',
+    'module_init': 'module_init',
+    'module_exit': 'module_exit',
+}
+
+
+def nbytes(data):
+    """Return the number of bytes a SPI write of *data* sends."""
+    if data is None:
+        return 0
+    if isinstance(data, int):
+        return 1
+    if isinstance(data, (list, tuple)):
+        return len(data)
+    return memoryview(data).nbytes
+
+
+def timed(func, group):
+    """Wrap the backend function *func*, adding its calls and time (and bytes sent) to stats."""
+    calls, seconds = group + '_calls', group + '_seconds'
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats[seconds] += time.perf_counter() - start
+            stats[calls] += 1
+            if group == 'spi':
+                stats['spi_bytes'] += sum(nbytes(data) for data in args)
+
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def wait_busy_polled(read, level, timeout=BUSY_TIMEOUT):
+    """Wait until read() returns *level*, for controllers that need a command
+    before every read of BUSY (the 0x71 GET STATUS of the UC8179).
+
+    Polls like the backends without edge events do and counts as a busy wait
+    in stats.
+    """
+    poll_busy(read, level, timeout)
+
+
+wait_busy_polled = timed(wait_busy_polled, 'busy')
+
+
+def byte_view(data):
+    """Return the bulk data of spi_writebyte2 as a sequence of ints.
+
+    Every backend accepts a list of ints as well as bytes, bytearray,
+    memoryview or a contiguous NumPy array of uint8; buffers are viewed as
+    unsigned bytes without copying.
+    """
+    if isinstance(data, list):
+        return data
+    return memoryview(data).cast('B')
+
 
 class RaspberryPi:
     # Pin definition
@@ -59,7 +180,6 @@ class RaspberryPi:
         self.GPIO_PWR_PIN    = gpiozero.LED(self.PWR_PIN)
         self.GPIO_BUSY_PIN   = gpiozero.Button(self.BUSY_PIN, pull_up = False)
 
-        
 
     def digital_write(self, pin, value):
         if pin == self.RST_PIN:
@@ -98,11 +218,31 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy(self, level, timeout=BUSY_TIMEOUT):
+        # gpiozero updates the active/inactive events from edge callbacks, so
+        # this sleeps until BUSY changes instead of polling the pin
+        if level:
+            ready = self.GPIO_BUSY_PIN.wait_for_active(timeout)
+        else:
+            ready = self.GPIO_BUSY_PIN.wait_for_inactive(timeout)
+        if not ready:
+            raise BusyTimeoutError("e-Paper BUSY pin not %d after %.1f s" % (level, timeout))
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        # writebytes2 takes lists and buffer objects alike and splits them
+        # into transfers of the spidev bufsiz itself
+        self.SPI.writebytes2(byte_view(data))
+
+    def spi_transaction(self, command, data=None):
+        # command byte with DC low, then all of its data with DC high
+        self.GPIO_DC_PIN.off()
+        self.SPI.writebytes([command])
+        if data is not None and len(data):
+            self.GPIO_DC_PIN.on()
+            self.spi_writebyte2(data)
 
     def DEV_SPI_write(self, data):
         self.DEV_SPI.DEV_SPI_SendData(data)
@@ -201,12 +341,25 @@ class JetsonNano:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy(self, level, timeout=BUSY_TIMEOUT):
+        poll_busy(lambda: self.GPIO.input(self.BUSY_PIN), level, timeout)
+
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
     def spi_writebyte2(self, data):
-        for i in range(len(data)):
-            self.SPI.SYSFS_software_spi_transfer(data[i])
+        # the software SPI takes one int per call
+        for byte in byte_view(data):
+            self.SPI.SYSFS_software_spi_transfer(byte)
+
+    def spi_transaction(self, command, data=None):
+        self.GPIO.output(self.DC_PIN, 0)
+        self.GPIO.output(self.CS_PIN, 0)
+        self.spi_writebyte([command])
+        if data is not None and len(data):
+            self.GPIO.output(self.DC_PIN, 1)
+            self.spi_writebyte2(data)
+        self.GPIO.output(self.CS_PIN, 1)
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -259,13 +412,27 @@ class SunriseX3:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy(self, level, timeout=BUSY_TIMEOUT):
+        poll_busy(lambda: self.GPIO.input(self.BUSY_PIN), level, timeout)
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
         # for i in range(len(data)):
         #     self.SPI.writebytes([data[i]])
-        self.SPI.xfer3(data)
+        # xfer3 wants a sequence of ints, which bytes is
+        data = byte_view(data)
+        self.SPI.xfer3(data if isinstance(data, list) else bytes(data))
+
+    def spi_transaction(self, command, data=None):
+        self.GPIO.output(self.DC_PIN, 0)
+        self.GPIO.output(self.CS_PIN, 0)
+        self.spi_writebyte([command])
+        if data is not None and len(data):
+            self.GPIO.output(self.DC_PIN, 1)
+            self.spi_writebyte2(data)
+        self.GPIO.output(self.CS_PIN, 1)
 
     def module_init(self):
         if self.Flag == 0:
@@ -301,22 +468,174 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
-if sys.version_info[0] == 2:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
-else:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
-output, _ = process.communicate()
-if sys.version_info[0] == 2:
-    output = output.decode(sys.stdout.encoding)
-
-if "Raspberry" in output:
-    implementation = RaspberryPi()
-elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
-    implementation = SunriseX3()
+# Panel controller families known to the Virtual backend (see epdtrace for
+# how their command streams are decoded):
+#   busy:    level of the BUSY pin while the controller is busy
+#   timings: BUSY time in seconds after a "full" or "partial" refresh, an
+#            update sequence that only loads settings ("load"), or a command
+VIRTUAL_PANELS = {
+    # UC8179 and the like, e.g. epd7in5_V2
+    "uc8179": {
+        "busy": 0,
+        "timings": {0x04: 0.1, 0x02: 0.05, "full": 3.5, "partial": 0.5},
+    },
+    # SSD1680/SSD1677 and the like, e.g. epd2in13_V4, epd13in3k; 0x12 is a
+    # software reset
+    "ssd16xx": {
+        "busy": 1,
+        "timings": {0x12: 0.01, "load": 0.05, "full": 2.0, "partial": 0.4},
+    },
+    # two SSD16xx controllers on one panel, e.g. epd5in79
+    "dual": {
+        "busy": 1,
+        "timings": {0x12: 0.01, "load": 0.05, "full": 3.0, "partial": 0.5},
+    },
+}
+
+
+class Virtual:
+    """Backend without hardware for development, benchmarks and CI.
+
+    Selected with EPD_BACKEND=virtual.  Every SPI transfer is recorded in
+    trace as (time, "command" or "data", bytes), resets as (time, "reset",
+    b""), and fed to an epdtrace decoder for the panel family
+    (EPD_VIRTUAL_PANEL, default uc8179), which rebuilds the controller RAM
+    and the displayed image.  BUSY stays active after the slow commands for
+    as long as that family would keep it, scaled by EPD_VIRTUAL_TIMESCALE (0
+    makes every wait and delay instant).  When EPD_VIRTUAL_DIR is set, the
+    displayed image is written there as a PNG after every refresh.  The
+    panel size comes from the commands or from EPD_VIRTUAL_SIZE, e.g. 800x480.
+    """
+    # Pin definition
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    def __init__(self, panel=None, timescale=None, output_dir=None, size=None, trace_length=None):
+        from . import epdtrace
+
+        panel = panel or os.getenv('EPD_VIRTUAL_PANEL', 'uc8179')
+        if panel not in VIRTUAL_PANELS:
+            raise ValueError("Unknown virtual panel %r, expected one of %s" % (panel, ", ".join(VIRTUAL_PANELS)))
+        self.panel = panel
+        self.family = VIRTUAL_PANELS[panel]
+        self.timescale = float(os.getenv('EPD_VIRTUAL_TIMESCALE', '1') if timescale is None else timescale)
+        self.output_dir = os.getenv('EPD_VIRTUAL_DIR') if output_dir is None else output_dir
+        size = size or os.getenv('EPD_VIRTUAL_SIZE')
+        if isinstance(size, str):
+            size = tuple(int(n) for n in size.lower().split('x'))
+        self.trace = collections.deque(maxlen=int(trace_length or os.getenv('EPD_VIRTUAL_TRACE', '10000')))
+        # keeps the last refreshes, with the displayed image after each
+        self.decoder = epdtrace.decoder(panel, *(size or (None, None)), keep=16)
+        self.frames = self.decoder.refreshes
+        self.dc = 0
+        self.busy_until = 0.0
+
+    def record(self, kind, data):
+        """Append a transfer or event to the trace and play it on the decoder."""
+        now = time.monotonic()
+        data = bytes(data)
+        self.trace.append((now, kind, data))
+        result = self.decoder.feed(kind, data, now)
+        if kind == "command":
+            busy = self.family["timings"].get(result or data[0], 0.0) * self.timescale
+            if busy:
+                self.busy_until = now + busy
+        if result in ("full", "partial") and self.output_dir:
+            refresh = self.frames[-1]
+            if refresh.image is not None:
+                path = os.path.join(self.output_dir, "frame-%06d.png" % (self.decoder.count - 1))
+                refresh.image.save(path)
+                logger.debug("virtual %s refresh written to %s", result, path)
+
+    def digital_write(self, pin, value):
+        if pin == self.DC_PIN:
+            self.dc = value
+        elif pin == self.RST_PIN and not value:
+            self.record("reset", b"")
+            self.busy_until = 0.0
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            busy = time.monotonic() < self.busy_until
+            return self.family["busy"] if busy else 1 - self.family["busy"]
+        return 0
+
+    def delay_ms(self, delaytime):
+        if self.timescale:
+            time.sleep(delaytime / 1000.0 * self.timescale)
+
+    def wait_busy(self, level, timeout=BUSY_TIMEOUT):
+        remaining = self.busy_until - time.monotonic()
+        if remaining > timeout:
+            time.sleep(timeout)
+            raise BusyTimeoutError("e-Paper BUSY pin not %d after %.1f s" % (level, timeout))
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def write(self, data):
+        if self.dc:
+            self.record("data", data)
+            return
+        for command in bytes(data):
+            self.record("command", [command])
+
+    def spi_writebyte(self, data):
+        self.write(bytes(x & 0xFF for x in data))
+
+    def spi_writebyte2(self, data):
+        if isinstance(data, list):
+            data = bytes(x & 0xFF for x in data)
+        self.write(byte_view(data))
+
+    def spi_transaction(self, command, data=None):
+        self.dc = 0
+        self.write([command])
+        if data is not None and len(data):
+            self.dc = 1
+            self.spi_writebyte2(data)
+
+    def DEV_SPI_write(self, data):
+        self.write([data & 0xFF])
+
+    def DEV_SPI_nwrite(self, data):
+        self.spi_writebyte2(data)
+
+    def DEV_SPI_read(self):
+        # epd4in2b_V2 tells its two controller versions apart by this byte
+        return 0x01 if self.panel != "uc8179" else 0x00
+
+    def module_init(self, cleanup=False):
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("virtual panel off")
+
+
+if os.getenv('EPD_BACKEND', '').lower() == 'virtual':
+    implementation = Virtual()
 else:
-    implementation = JetsonNano()
+    if sys.version_info[0] == 2:
+        process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
+    else:
+        process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
+    output, _ = process.communicate()
+    if sys.version_info[0] == 2:
+        output = output.decode(sys.stdout.encoding)
+
+    if "Raspberry" in output:
+        implementation = RaspberryPi()
+    elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
+        implementation = SunriseX3()
+    else:
+        implementation = JetsonNano()
 
 for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+    attr = getattr(implementation, func)
+    if func in TIMED_CALLS:
+        attr = timed(attr, TIMED_CALLS[func])
+    setattr(sys.modules[__name__], func, attr)
 
 ### END OF FILE ###
@@ -0,0 +1,224 @@
+# *****************************************************************************
+# * | File        :	  epddither.py
+# * | Function    :   Dithering of frames to the panel gray levels and palettes
+# * | Info        :
+# *----------------
+# * | Info        :   Threshold, ordered (Bayer), Floyd-Steinberg and Atkinson
+# *                   dithering with a selectable speed/quality trade-off
+# ******************************************************************************
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documnetation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to  whom the Software is
+# furished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS OR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+import functools
+import logging
+
+import numpy as np
+from PIL import Image
+
+from . import epdcolor
+
+logger = logging.getLogger(__name__)
+
+# Dithering modes, roughly from fastest to best looking
+MODES = ("none", "bayer", "stable", "floyd-steinberg", "atkinson")
+
+# Distance from a gray level (or palette color) within which the "stable"
+# mode snaps to it instead of dithering, in 8 bit units
+STABLE_MARGIN = 8
+
+# Gray levels the panels can show, as 8 bit luminance values
+GRAY2 = (0x00, 0xFF)                # black/white panels
+GRAY4 = (0x00, 0x80, 0xC0, 0xFF)    # 4 gray mode, see epdbuffer.GRAY4_LUT
+
+
+def bayer_matrix(size=8):
+    """Return the size x size Bayer threshold matrix, values in (0, 1)."""
+    m = np.array([[0, 2], [3, 1]])
+    while m.shape[0] < size:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return (m + 0.5) / m.size
+
+
+BAYER8 = bayer_matrix(8)
+
+
+def _thresholds(height, width):
+    """Bayer thresholds for every pixel, tiled from the top left corner."""
+    return BAYER8[np.arange(height)[:, None] % 8, np.arange(width) % 8]
+
+
+@functools.lru_cache(maxsize=None)
+def _level_table(levels):
+    """256 entry table from a luminance value to the index of the nearest level."""
+    values = np.arange(256)[:, None]
+    return np.abs(values - np.array(levels)).argmin(axis=1).astype(np.uint8)
+
+
+def _atkinson_gray(values, levels):
+    """Atkinson error diffusion of a 2D luminance array to level indices.
+
+    Each pixel passes 1/8 of its error to six neighbours (3/4 in total),
+    which keeps highlights and shadows cleaner than Floyd-Steinberg.  The
+    scan is inherently serial, so this runs as a plain Python loop.
+    """
+    height, width = values.shape
+    table = _level_table(tuple(levels)).tolist()
+    # two columns of padding on either side, two extra rows at the bottom
+    rows = [[0.0, 0.0] + row + [0.0, 0.0] for row in values.astype(float).tolist()]
+    rows += [[0.0] * (width + 4) for _ in range(2)]
+    out = np.empty((height, width), dtype=np.uint8)
+    for y in range(height):
+        row, below, below2 = rows[y], rows[y + 1], rows[y + 2]
+        indices = [0] * width
+        for x in range(2, width + 2):
+            v = row[x]
+            i = table[0 if v < 0 else 255 if v > 255 else int(v + 0.5)]
+            indices[x - 2] = i
+            e = (v - levels[i]) / 8
+            row[x + 1] += e
+            row[x + 2] += e
+            below[x - 1] += e
+            below[x] += e
+            below[x + 1] += e
+            below2[x] += e
+        out[y] = indices
+    return out
+
+
+def _atkinson_palette(rgb, palette):
+    """Atkinson error diffusion of an (h, w, 3) array to palette indices."""
+    height, width = rgb.shape[:2]
+    lut = epdcolor.rgb_lut(palette, 5).tolist()
+    colors = [tuple(float(c) for c in color) for color in palette]
+    planes = []
+    for channel in range(3):
+        rows = [[0.0, 0.0] + row + [0.0, 0.0] for row in rgb[..., channel].astype(float).tolist()]
+        rows += [[0.0] * (width + 4) for _ in range(2)]
+        planes.append(rows)
+    out = np.empty((height, width), dtype=np.uint8)
+    for y in range(height):
+        rr, gg, bb = (plane[y] for plane in planes)
+        indices = [0] * width
+        for x in range(2, width + 2):
+            r, g, b = rr[x], gg[x], bb[x]
+            i = lut[0 if r < 0 else 31 if r > 255 else int(r) >> 3][0 if g < 0 else 31 if g > 255 else int(g) >> 3][0 if b < 0 else 31 if b > 255 else int(b) >> 3]
+            indices[x - 2] = i
+            color = colors[i]
+            for plane, e in zip(planes, ((r - color[0]) / 8, (g - color[1]) / 8, (b - color[2]) / 8)):
+                row, below, below2 = plane[y], plane[y + 1], plane[y + 2]
+                row[x + 1] += e
+                row[x + 2] += e
+                below[x - 1] += e
+                below[x] += e
+                below[x + 1] += e
+                below2[x] += e
+        out[y] = indices
+    return out
+
+
+def gray_indices(image, levels=GRAY2, mode="floyd-steinberg"):
+    """Dither *image* to the given gray levels, returning a 2D array of level indices.
+
+    ``none`` picks the nearest level, ``bayer`` is ordered dithering with an
+    8x8 Bayer matrix (vectorized, and a pixel's result only depends on its
+    value and position, so it is stable between frames), ``stable`` is the
+    same but snaps values within STABLE_MARGIN of a level to it, so flat
+    areas, anti-aliasing and capture noise never turn into stray dots that
+    come and go between frames, ``floyd-steinberg``
+    is PIL's error diffusion (what Image.convert('1') does) and ``atkinson``
+    a pure Python error diffusion that is slow but looks best on text and
+    line art.
+    """
+    levels = tuple(levels)
+    gray = image.convert('L')
+    if mode == "none":
+        return _level_table(levels)[np.asarray(gray)]
+    if mode in ("bayer", "stable"):
+        values = np.asarray(gray, dtype=np.float32)
+        lv = np.array(levels, dtype=np.float32)
+        # position within the interval between the two surrounding levels
+        upper = np.clip(np.searchsorted(lv, values, side='right'), 1, len(lv) - 1)
+        low, high = lv[upper - 1], lv[upper]
+        fraction = (values - low) / (high - low)
+        thresholds = _thresholds(*values.shape)
+        if mode == "stable":
+            margin = STABLE_MARGIN / (high - low)
+            thresholds = np.clip(thresholds, margin, 1 - margin)
+        above = fraction > thresholds
+        return np.where(above, upper, upper - 1).astype(np.uint8)
+    if mode == "floyd-steinberg":
+        if levels == GRAY2:
+            return np.asarray(gray.convert('1'), dtype=np.uint8)
+        palette = tuple((v, v, v) for v in levels)
+        return np.asarray(gray.convert('RGB').quantize(palette=epdcolor.palette_image(palette)))
+    if mode == "atkinson":
+        return _atkinson_gray(np.asarray(gray), levels)
+    raise ValueError("Unknown dithering mode: %r, expected one of %s" % (mode, ", ".join(MODES)))
+
+
+def palette_indices(image, palette, mode="floyd-steinberg", spread=96):
+    """Dither *image* to *palette*, returning a 2D array of palette indices.
+
+    Same modes as gray_indices; ``spread`` is the amplitude of the Bayer
+    offset added to each channel before the nearest color is picked, the
+    ``stable`` mode leaves out the offset for pixels within STABLE_MARGIN of
+    a palette color.
+    """
+    palette = tuple(tuple(color) for color in palette)
+    pal_image = epdcolor.palette_image(palette)
+    rgb_image = image.convert('RGB')
+    if mode == "none":
+        return np.asarray(rgb_image.quantize(palette=pal_image, dither=Image.Dither.NONE))
+    if mode in ("bayer", "stable"):
+        rgb = np.asarray(rgb_image, dtype=np.float32)
+        offset = (_thresholds(*rgb.shape[:2]) - 0.5) * spread
+        if mode == "stable":
+            nearest = np.array(palette, dtype=np.float32)[
+                np.asarray(rgb_image.quantize(palette=pal_image, dither=Image.Dither.NONE))]
+            offset[np.abs(rgb - nearest).max(axis=2) <= STABLE_MARGIN] = 0
+        rgb = np.clip(rgb + offset[..., None], 0, 255).astype(np.uint8)
+        return np.asarray(Image.fromarray(rgb, 'RGB').quantize(palette=pal_image, dither=Image.Dither.NONE))
+    if mode == "floyd-steinberg":
+        return np.asarray(rgb_image.quantize(palette=pal_image))
+    if mode == "atkinson":
+        return _atkinson_palette(np.asarray(rgb_image), palette)
+    raise ValueError("Unknown dithering mode: %r, expected one of %s" % (mode, ", ".join(MODES)))
+
+
+def dither_gray(image, levels=GRAY2, mode="floyd-steinberg"):
+    """Return *image* dithered to the gray *levels* as an "L" image.
+
+    Every pixel is exactly one of the levels, so the drivers' getbuffer
+    (convert('1') or the 4 gray packing) passes it through unchanged.
+    """
+    lv = np.array(levels, dtype=np.uint8)
+    return Image.fromarray(lv[gray_indices(image, levels, mode)], 'L')
+
+
+def dither_palette(image, palette, mode="floyd-steinberg"):
+    """Return *image* dithered to *palette* as an "RGB" image of palette colors.
+
+    The colour drivers' getbuffer maps such an image to the panel colors
+    without further dithering.
+    """
+    colors = np.array(palette, dtype=np.uint8)
+    return Image.fromarray(colors[palette_indices(image, palette, mode)], 'RGB')
+
+### END OF FILE ###
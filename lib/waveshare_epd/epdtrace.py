@@ -0,0 +1,495 @@
+# *****************************************************************************
+# * | File        :	  epdtrace.py
+# * | Function    :   Decoding of recorded e-paper controller command streams
+# * | Info        :
+# *----------------
+# * | Info        :   Rebuilds the controller RAM, the refresh windows and the
+# *                   displayed image from the transfers recorded by the
+# *                   Virtual backend of epdconfig
+# ******************************************************************************
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documnetation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to  whom the Software is
+# furished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS OR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import collections
+import logging
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# One panel refresh: the window of the screen it updated as (xstart, ystart,
+# xend, yend) in pixels, ends exclusive, the displayed image after it (mode
+# '1') and the bytes and transfers sent since the previous refresh.
+Refresh = collections.namedtuple("Refresh", "time kind window image bytes transfers")
+
+
+class Decoder:
+    """Replays a command stream against a model of the controller.
+
+    feed() takes the entries of a trace one by one: ("command", bytes),
+    ("data", bytes) or ("reset", b"").  Register writes take effect when the
+    next command starts, RAM writes as the data arrives.  Every refresh is
+    appended to refreshes; screen holds the displayed image as a boolean
+    array, True being white.  Only the black/white plane is decoded, 4 gray
+    and colour refreshes show up as their first plane.
+    """
+
+    def __init__(self, width=None, height=None, keep=None):
+        self.width = width
+        self.height = height
+        self.screen = None
+        self.refreshes = collections.deque(maxlen=keep) if keep else []
+        self.command = None
+        self.params = {}
+        self.bytes = 0
+        self.transfers = 0
+        self.commands = 0
+        self.count = 0
+        self._bytes = 0
+        self._transfers = 0
+        self.reset()
+
+    def reset(self):
+        """Hardware reset: the registers go back to their defaults, the RAM is kept."""
+        self.command = None
+        self.params = {}
+
+    def feed(self, kind, data, timestamp=None):
+        """Apply one trace entry.
+
+        Returns "full" or "partial" when a command refreshed the panel,
+        "load" for an update sequence that does not drive the panel, None
+        otherwise.
+        """
+        if kind == "reset":
+            self.finish()
+            self.reset()
+            return None
+        data = bytes(data)
+        self.bytes += len(data)
+        self.transfers += 1
+        self._bytes += len(data)
+        self._transfers += 1
+        if kind != "command":
+            if self.command is not None and not self.write_ram(self.command, data):
+                self.params[self.command].extend(data)
+            return None
+        result = None
+        for command in data:
+            self.finish()
+            self.commands += 1
+            self.command = command
+            self.params[command] = bytearray()
+            result = self.start(command, timestamp) or result
+        return result
+
+    def decode(self, trace):
+        """Feed a whole trace of (time, kind, data) entries, returns self."""
+        for timestamp, kind, data in trace:
+            self.feed(kind, data, timestamp)
+        return self
+
+    def finish(self):
+        """Apply the parameters of the command that is ending."""
+        if self.command is not None:
+            self.set_register(self.command, bytes(self.params[self.command]))
+
+    def set_register(self, command, params):
+        pass
+
+    def start(self, command, timestamp):
+        return None
+
+    def write_ram(self, command, data):
+        """Store RAM data of *command*, returns False when it is not a RAM write."""
+        return False
+
+    def panel_size(self):
+        """Return the (width, height) of the panel, or None while it is not known."""
+        if self.width and self.height:
+            return self.width, self.height
+        return None
+
+    def update(self, kind, window, timestamp):
+        """Record a refresh that updated *window* of the screen."""
+        image = Image.fromarray(self.screen) if self.screen is not None else None
+        self.refreshes.append(Refresh(timestamp, kind, window, image, self._bytes, self._transfers))
+        self.count += 1
+        self._bytes = 0
+        self._transfers = 0
+
+    def image(self):
+        """Return the displayed image as a PIL image (mode '1'), or None before any refresh."""
+        if self.screen is None:
+            return None
+        return Image.fromarray(self.screen)
+
+    def stats(self):
+        """Return the totals of the decoded stream."""
+        return {
+            "bytes": self.bytes,
+            "transfers": self.transfers,
+            "commands": self.commands,
+            "refreshes": self.count,
+        }
+
+
+class UC8179Decoder(Decoder):
+    """UC8179 style controllers, e.g. epd7in5_V2.
+
+    0x10 and 0x13 write the old and new image RAM, 0x61 sets the resolution,
+    0x90 the partial window (active after 0x91, until 0x92) and 0x12
+    refreshes.  The data polarity of the new image follows the DDX bits of
+    0x50.
+    """
+
+    def __init__(self, width=None, height=None, keep=None):
+        self.ram = {}
+        self.warned = False
+        super().__init__(width, height, keep)
+
+    def reset(self):
+        super().reset()
+        self.partial = False
+        self.window = None
+        self.black = 1  # DDX of the power on value 0x31
+        self.pointer = 0
+
+    def panel_size(self):
+        size = super().panel_size()
+        if size is None and not self.warned:
+            logger.warning("UC8179 trace: RAM written before the resolution (0x61) is known")
+            self.warned = True
+        return size
+
+    def set_register(self, command, params):
+        if command == 0x61 and len(params) >= 4:
+            self.width = params[0] << 8 | params[1]
+            self.height = params[2] << 8 | params[3]
+        elif command == 0x50 and params:
+            # DDX[0] set: a set bit of the new image RAM is black
+            self.black = params[0] >> 4 & 1
+        elif command == 0x90 and len(params) >= 8:
+            xstart = (params[0] << 8 | params[1]) & ~7
+            xend = ((params[2] << 8 | params[3]) | 7) + 1
+            ystart = params[4] << 8 | params[5]
+            yend = (params[6] << 8 | params[7]) + 1
+            self.window = (xstart, ystart, xend, yend)
+
+    def start(self, command, timestamp):
+        if command == 0x91:
+            self.partial = True
+        elif command == 0x92:
+            self.partial = False
+        elif command in (0x10, 0x13):
+            self.pointer = 0
+        elif command == 0x12:
+            return self.refresh(timestamp)
+        return None
+
+    def active_window(self, width, height):
+        if self.partial and self.window is not None:
+            xstart, ystart, xend, yend = self.window
+            return (max(xstart, 0), max(ystart, 0), min(xend, width), min(yend, height))
+        return (0, 0, width, height)
+
+    def write_ram(self, command, data):
+        if command not in (0x10, 0x13):
+            return False
+        size = self.panel_size()
+        if size is None:
+            return True
+        width, height = size
+        ram = self.ram.get(command)
+        if ram is None or ram.shape != (height, (width + 7) // 8):
+            ram = self.ram[command] = np.zeros((height, (width + 7) // 8), dtype=np.uint8)
+        xstart, ystart, xend, yend = self.active_window(width, height)
+        region = ram[ystart:yend, xstart // 8:(xend + 7) // 8]
+        flat = region.reshape(-1).copy()
+        chunk = np.frombuffer(data, dtype=np.uint8)[:max(flat.size - self.pointer, 0)]
+        flat[self.pointer:self.pointer + chunk.size] = chunk
+        region[...] = flat.reshape(region.shape)
+        self.pointer += len(data)
+        return True
+
+    def refresh(self, timestamp):
+        kind = "partial" if self.partial else "full"
+        size = self.panel_size()
+        if size is None:
+            self.update(kind, None, timestamp)
+            return kind
+        width, height = size
+        if self.screen is None or self.screen.shape != (height, width):
+            self.screen = np.ones((height, width), dtype=bool)
+        ram = self.ram.get(0x13)
+        if ram is None:
+            ram = np.zeros((height, (width + 7) // 8), dtype=np.uint8)
+        white = np.unpackbits(ram, axis=1)[:, :width] != self.black
+        xstart, ystart, xend, yend = window = self.active_window(width, height)
+        self.screen[ystart:yend, xstart:xend] = white[ystart:yend, xstart:xend]
+        self.update(kind, window, timestamp)
+        return kind
+
+
+class _SSDRam:
+    """Address space of one SSD16xx controller: window, counters and RAM."""
+
+    def __init__(self):
+        self.ram = {}
+        self.reset()
+
+    def reset(self):
+        self.entry = 0x03
+        self.xwindow = None
+        self.ywindow = None
+        self.x = 0
+        self.y = 0
+
+    def write(self, plane, data, columns, rows):
+        """Write *data* at the address counter, moving it as the data entry mode says."""
+        ram = self.ram.get(plane)
+        if ram is None or ram.shape != (rows, columns):
+            ram = self.ram[plane] = np.full((rows, columns), 0xFF, dtype=np.uint8)
+        xstart, xend = self.xwindow or (0, columns - 1)
+        ystart, yend = self.ywindow or (0, rows - 1)
+        xstep = 1 if self.entry & 0x01 else -1
+        ystep = 1 if self.entry & 0x02 else -1
+        xcount = abs(xend - xstart) + 1
+        ycount = abs(yend - ystart) + 1
+        xoffset = (self.x - xstart) * xstep % xcount
+        yoffset = (self.y - ystart) * ystep % ycount
+        # position of every byte in the scan of the window, plus the one after
+        # the last byte where the counter stops; the scan wraps to the start
+        if self.entry & 0x04:
+            # the counter moves in the Y direction first
+            positions = (xoffset * ycount + yoffset + np.arange(len(data) + 1)) % (xcount * ycount)
+            xs, ys = positions // ycount, positions % ycount
+        else:
+            positions = (yoffset * xcount + xoffset + np.arange(len(data) + 1)) % (xcount * ycount)
+            xs, ys = positions % xcount, positions // xcount
+        xs = (xstart + xs * xstep) % columns
+        ys = (ystart + ys * ystep) % rows
+        ram[ys[:-1], xs[:-1]] = np.frombuffer(data, dtype=np.uint8)
+        self.x, self.y = int(xs[-1]), int(ys[-1])
+        return xs[:-1], ys[:-1]
+
+    def plane(self, plane, columns, rows):
+        """Return the RAM in the order it was written, flipping the axes the counter decrements."""
+        ram = self.ram.get(plane)
+        if ram is None:
+            return np.full((rows, columns), 0xFF, dtype=np.uint8)
+        if not self.entry & 0x01:
+            ram = ram[:, ::-1]
+        if not self.entry & 0x02:
+            ram = ram[::-1, :]
+        return ram
+
+
+class SSD16xxDecoder(Decoder):
+    """SSD1680/SSD1677 style controllers, e.g. epd2in13_V4 and epd13in3k.
+
+    0x24 and 0x26 write the black/white and the red (or previous) RAM at the
+    address counter (0x4E/0x4F) within the window (0x44/0x45), 0x11 sets the
+    data entry mode and 0x20 runs the update sequence chosen with 0x22.  Two
+    byte windows and counters are in bytes, four and two byte ones (large
+    panels) in pixels.  A set bit of the black/white RAM is white.
+    """
+
+    # RAM, X window, Y window, X counter, Y counter and data entry commands of each controller
+    CONTROLLERS = {"master": (0x24, 0x26, 0x44, 0x45, 0x4E, 0x4F, 0x11)}
+
+    def __init__(self, width=None, height=None, keep=None):
+        self.controllers = {name: _SSDRam() for name in self.CONTROLLERS}
+        self.gates = None
+        self.dirty = None
+        super().__init__(width, height, keep)
+
+    def reset(self):
+        super().reset()
+        self.sequence = 0xF7
+        for controller in self.controllers.values():
+            controller.reset()
+
+    def set_register(self, command, params):
+        if command == 0x01 and len(params) >= 2:
+            self.gates = (params[0] | params[1] << 8) + 1
+        elif command == 0x22 and params:
+            self.sequence = params[0]
+        for name, (bw, red, xwin, ywin, xcnt, ycnt, entry) in self.CONTROLLERS.items():
+            controller = self.controllers[name]
+            if command == xwin and len(params) >= 4:
+                controller.xwindow = ((params[0] | params[1] << 8) >> 3, (params[2] | params[3] << 8) >> 3)
+            elif command == xwin and len(params) >= 2:
+                controller.xwindow = (params[0], params[1])
+            elif command == ywin and len(params) >= 4:
+                controller.ywindow = (params[0] | params[1] << 8, params[2] | params[3] << 8)
+            elif command == xcnt and len(params) >= 2:
+                controller.x = (params[0] | params[1] << 8) >> 3
+            elif command == xcnt and params:
+                controller.x = params[0]
+            elif command == ycnt and len(params) >= 2:
+                controller.y = params[0] | params[1] << 8
+            elif command == entry and params:
+                controller.entry = params[0]
+
+    def start(self, command, timestamp):
+        if command == 0x12:
+            # software reset
+            for controller in self.controllers.values():
+                controller.reset()
+        elif command == 0x20:
+            # bit 2 of the sequence drives the panel, bit 3 selects display mode 2
+            if not self.sequence & 0x04:
+                return "load"
+            kind = "partial" if self.sequence & 0x08 else "full"
+            self.refresh(kind, timestamp)
+            return kind
+        return None
+
+    def ram_size(self):
+        """Return the (columns, rows) of the RAM of one controller, in bytes and lines."""
+        size = self.panel_size()
+        if size is not None:
+            return (size[0] + 7) // 8, size[1]
+        controller = self.controllers["master"]
+        if controller.xwindow is None:
+            return None
+        columns = abs(controller.xwindow[1] - controller.xwindow[0]) + 1
+        if self.gates:
+            rows = self.gates
+        elif controller.ywindow is not None:
+            rows = abs(controller.ywindow[1] - controller.ywindow[0]) + 1
+        else:
+            return None
+        self.width, self.height = self.stitched_width(columns) * 8, rows
+        return columns, rows
+
+    def stitched_width(self, columns):
+        return columns
+
+    def write_ram(self, command, data):
+        for name, (bw, red, *_) in self.CONTROLLERS.items():
+            if command in (bw, red):
+                break
+        else:
+            return False
+        size = self.ram_size()
+        if size is None:
+            logger.warning("SSD16xx trace: RAM written before the window is known")
+            return True
+        xs, ys = self.controllers[name].write(command == bw, data, *size)
+        if command == bw and len(xs):
+            self.mark_dirty(name, xs, ys, *size)
+        return True
+
+    def mark_dirty(self, name, xs, ys, columns, rows):
+        controller = self.controllers[name]
+        if not controller.entry & 0x01:
+            xs = columns - 1 - xs
+        if not controller.entry & 0x02:
+            ys = rows - 1 - ys
+        xs = xs + self.column_offset(name, columns)
+        window = (int(xs.min()) * 8, int(ys.min()), int(xs.max() + 1) * 8, int(ys.max()) + 1)
+        if self.dirty is not None:
+            window = (min(window[0], self.dirty[0]), min(window[1], self.dirty[1]),
+                      max(window[2], self.dirty[2]), max(window[3], self.dirty[3]))
+        self.dirty = window
+
+    def column_offset(self, name, columns):
+        return 0
+
+    def refresh(self, kind, timestamp):
+        size = self.ram_size()
+        if size is None:
+            self.update(kind, None, timestamp)
+            return
+        columns, rows = size
+        ram = np.full((rows, self.stitched_width(columns)), 0xFF, dtype=np.uint8)
+        for name in self.CONTROLLERS:
+            offset = self.column_offset(name, columns)
+            ram[:, offset:offset + columns] = self.controllers[name].plane(True, columns, rows)
+        width, height = self.width or ram.shape[1] * 8, self.height or rows
+        self.screen = np.unpackbits(ram, axis=1)[:height, :width].astype(bool)
+        window = self.dirty or (0, 0, width, height)
+        self.dirty = None
+        self.update(kind, (window[0], window[1], min(window[2], width), min(window[3], height)), timestamp)
+
+
+class DualSSD16xxDecoder(SSD16xxDecoder):
+    """Two SSD16xx controllers sharing one panel, e.g. epd5in79.
+
+    The master (0x24/0x26, 0x44/0x45, 0x4E/0x4F, 0x11) drives the left half,
+    the slave (0xA4/0xA6, 0xC4/0xC5, 0xCE/0xCF, 0x91) the right half; the
+    halves overlap by one byte column.
+    """
+
+    CONTROLLERS = {
+        "master": (0x24, 0x26, 0x44, 0x45, 0x4E, 0x4F, 0x11),
+        "slave": (0xA4, 0xA6, 0xC4, 0xC5, 0xCE, 0xCF, 0x91),
+    }
+
+    def ram_size(self):
+        size = self.panel_size()
+        if size is not None:
+            return size[0] // 16 + 1, size[1]
+        return super().ram_size()
+
+    def stitched_width(self, columns):
+        return columns * 2 - 1
+
+    def column_offset(self, name, columns):
+        return columns - 1 if name == "slave" else 0
+
+
+FAMILIES = {
+    "uc8179": UC8179Decoder,
+    "ssd16xx": SSD16xxDecoder,
+    "dual": DualSSD16xxDecoder,
+}
+
+
+def decoder(family, width=None, height=None, keep=None):
+    """Return a decoder for the controller *family*, see FAMILIES."""
+    if family not in FAMILIES:
+        raise ValueError("Unknown controller family %r, expected one of %s" % (family, ", ".join(FAMILIES)))
+    return FAMILIES[family](width, height, keep)
+
+
+def decode(trace, family, width=None, height=None):
+    """Decode a whole trace, returns the decoder with its refreshes and totals."""
+    return decoder(family, width, height).decode(trace)
+
+
+def save_trace(trace, path):
+    """Write a trace as text, one "time kind hexdata" line per entry."""
+    with open(path, "w") as f:
+        for timestamp, kind, data in trace:
+            f.write("%.6f %s %s\n" % (timestamp, kind, bytes(data).hex()))
+
+
+def load_trace(path):
+    """Read a trace written by save_trace()."""
+    trace = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 2:
+                trace.append((float(fields[0]), fields[1], bytes.fromhex(fields[2] if len(fields) > 2 else "")))
+    return trace
@@ -0,0 +1,216 @@
+import logging
+import select
+import socket
+import struct
+import threading
+import time
+
+# rtnetlink multicast groups of IPv4 address and route changes (linux/rtnetlink.h)
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+
+# rtnetlink message types that can change the local address (linux/rtnetlink.h)
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+ADDRESS_CHANGES = (RTM_NEWADDR, RTM_DELADDR, RTM_NEWROUTE, RTM_DELROUTE)
+
+# struct nlmsghdr: length, type, flags, sequence number, port id
+NLMSGHDR = struct.Struct("=IHHII")
+
+FALLBACK_IP = "127.0.0.1"
+
+
+def message_types(data):
+    """Return the types of the netlink messages in the datagram *data*."""
+    types = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, kind, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        types.append(kind)
+        offset += (length + 3) & ~3  # NLMSG_ALIGN
+    return types
+
+
+def is_address_change(data):
+    """Return True if the netlink datagram *data* adds or removes an address or a route."""
+    return any(kind in ADDRESS_CHANGES for kind in message_types(data))
+
+
+def probe_local_ip(target=("8.8.8.8", 80)):
+    """Return the address of the interface with the route to *target*.
+
+    Connecting a UDP socket sends nothing, it only makes the kernel pick
+    the source address.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(target)
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+
+class NetlinkSource:
+    """Address change notifications from the kernel over rtnetlink (Linux only)."""
+
+    def __init__(self, groups=RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.sock.bind((0, groups))
+        self.sock.setblocking(False)
+
+    def wait(self, timeout):
+        """Wait up to *timeout* seconds for a change, returns True if there was one."""
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return False
+        # one change usually comes as several messages, take them all
+        changed = False
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                changed = changed or is_address_change(data)
+        except BlockingIOError:
+            pass
+        return changed
+
+    def close(self):
+        self.sock.close()
+
+
+class EventSource:
+    """Change source fed by hand, e.g. a fake netlink socket in tests or a hook.
+
+    notify() reports a change; notify(data) passes a raw netlink datagram
+    instead, which counts as a change only when it adds or removes an
+    address or a route, as with NetlinkSource.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.messages = []
+
+    def notify(self, data=None):
+        with self.condition:
+            self.messages.append(data)
+            self.condition.notify_all()
+
+    def wait(self, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.messages, timeout)
+            messages, self.messages = self.messages, []
+        return any(data is None or is_address_change(data) for data in messages)
+
+    def close(self):
+        self.notify()
+
+
+class LocalIP:
+    """Caches the local IP address and refreshes it when the network changes.
+
+    The address is probed once and then again only when *source* reports a
+    change (rtnetlink on Linux, see NetlinkSource), or every *interval*
+    seconds in any case.  Without a source (netlink unavailable) the
+    address is probed every *fallback_interval* seconds.  get() never
+    touches the network; wait_for_change() lets another thread sleep until
+    the address differs from the one it knows.
+    """
+
+    def __init__(self, source=None, probe=probe_local_ip, interval=600, fallback_interval=60, name="local-ip"):
+        self.source = source
+        self.probe = probe
+        self.fallback_interval = fallback_interval
+        self.interval = interval if source is not None else fallback_interval
+        self.condition = threading.Condition()
+        self.ip = None
+        self.probes = 0
+        self.changes = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    @classmethod
+    def create(cls, **kwargs):
+        """Return a started LocalIP watching rtnetlink, or polling where that is not available."""
+        try:
+            source = NetlinkSource()
+        except (AttributeError, OSError) as e:
+            logging.info("Network change notifications unavailable, polling the local IP: %s", e)
+            source = None
+        return cls(source, **kwargs).start()
+
+    def start(self):
+        self.refresh()
+        self.thread.start()
+        return self
+
+    def refresh(self):
+        """Probe the address now and return it."""
+        try:
+            ip = self.probe()
+        except OSError as e:
+            logging.error("Error getting local IP: %s", e)
+            ip = FALLBACK_IP
+        with self.condition:
+            self.probes += 1
+            if ip != self.ip:
+                if self.ip is not None:
+                    logging.info("Local IP changed from %s to %s", self.ip, ip)
+                    self.changes += 1
+                self.ip = ip
+                self.condition.notify_all()
+        return ip
+
+    def get(self):
+        """Return the cached address, probing it only before the first refresh."""
+        ip = self.ip
+        return ip if ip is not None else self.refresh()
+
+    def wait_for_change(self, known, timeout=None):
+        """Wait until the address differs from *known*; returns the current address, *known* after a timeout."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or (self.ip is not None and self.ip != known), timeout)
+            return self.ip
+
+    def run(self):
+        deadline = time.monotonic() + self.interval
+        while not self.closed:
+            changed = False
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                if self.source is not None:
+                    changed = self.source.wait(timeout)
+                else:
+                    with self.condition:
+                        self.condition.wait_for(lambda: self.closed, timeout)
+            except Exception as e:
+                if self.closed:
+                    return
+                logging.error("Network change source failed, polling the local IP: %s", e)
+                self.source = None
+                self.interval = self.fallback_interval
+            # messages that do not touch an address (link state and the
+            # like) wake the source without a probe
+            if not self.closed and (changed or time.monotonic() >= deadline):
+                self.refresh()
+                deadline = time.monotonic() + self.interval
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.source is not None:
+            self.source.close()
+
+    def stats(self):
+        """Return the cached address and the probe and change counters."""
+        return {
+            "ip": self.ip,
+            "netlink": isinstance(self.source, NetlinkSource),
+            "probes": self.probes,
+            "changes": self.changes,
+        }
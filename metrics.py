@@ -0,0 +1,222 @@
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds: from the millisecond
+# conversions to the multi-second browser captures and panel refreshes
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return "%d" % value
+    return repr(value)
+
+
+def format_labels(label, value, extra=""):
+    labels = []
+    if label is not None and value is not None:
+        labels.append('%s="%s"' % (label, str(value).replace("\\", "\\\\").replace('"', '\\"')))
+    if extra:
+        labels.append(extra)
+    return "{%s}" % ",".join(labels) if labels else ""
+
+
+class Counter:
+    """Value that only goes up, one series per value of *label*."""
+
+    type = "counter"
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        # an unlabelled metric is exported from the start, as 0
+        self.series = {} if label else {None: 0}
+        self.lock = threading.Lock()
+
+    def inc(self, label=None, amount=1):
+        """Add *amount* to the series of *label*."""
+        with self.lock:
+            self.series[label] = self.series.get(label, 0) + amount
+
+    def value(self, label=None):
+        return self.series.get(label, 0)
+
+    def samples(self):
+        """Return the (label, value) pairs to export."""
+        with self.lock:
+            return list(self.series.items())
+
+    def collect(self):
+        """Yield the lines of the metric in the Prometheus text format."""
+        yield "# HELP %s %s" % (self.name, self.help)
+        yield "# TYPE %s %s" % (self.name, self.type)
+        for label, value in sorted(self.samples(), key=lambda item: str(item[0])):
+            yield "%s%s %s" % (self.name, format_labels(self.label, label), format_value(value))
+
+
+class Gauge(Counter):
+    """Value that goes up and down, set directly or read from *fn* on every export.
+
+    fn returns a number, or a dict of numbers by label value; None or an
+    exception leaves the gauge out of the export.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, help, label=None, fn=None):
+        super().__init__(name, help, label)
+        self.fn = fn
+
+    def set(self, value, label=None):
+        with self.lock:
+            self.series[label] = value
+
+    def samples(self):
+        if self.fn is None:
+            return super().samples()
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return list(value.items())
+        return [(None, value)]
+
+
+class Histogram:
+    """Distribution of observed values, one series per value of *label*.
+
+    Keeps a count per bucket plus the sum and the count of the
+    observations, which is all the Prometheus text format needs.
+    """
+
+    def __init__(self, name, help, label=None, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label=None):
+        """Record *value* in the series of *label*."""
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                # one count per bucket and one for +Inf, then the sum
+                series = self.series[label] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, label=None):
+        """Context manager recording how long its block took, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label)
+
+    def collect(self):
+        """Yield the lines of the histogram in the Prometheus text format."""
+        yield "# HELP %s %s" % (self.name, self.help)
+        yield "# TYPE %s histogram" % self.name
+        with self.lock:
+            series = sorted(self.series.items(), key=lambda item: str(item[0]))
+            series = [(label, list(values)) for label, values in series]
+        for label, values in series:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                total += count
+                yield "%s_bucket%s %d" % (
+                    self.name, format_labels(self.label, label, 'le="%s"' % format_value(bound)), total)
+            yield "%s_sum%s %s" % (self.name, format_labels(self.label, label), format_value(values[-1]))
+            yield "%s_count%s %d" % (self.name, format_labels(self.label, label), total)
+
+
+class Registry:
+    """The metrics exported by the /metrics endpoint."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label=None):
+        return self.register(Counter(name, help, label))
+
+    def gauge(self, name, help, label=None, fn=None):
+        return self.register(Gauge(name, help, label, fn))
+
+    def histogram(self, name, help, label=None, buckets=TIME_BUCKETS):
+        return self.register(Histogram(name, help, label, buckets))
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Time spent in each step of a refresh cycle: capture, decode, resize,
+# dither, getbuffer, wake, transfer, busy, sleep, display
+stage_seconds = registry.histogram(
+    "epaper_stage_seconds", "Duration of the steps of a refresh cycle.", label="stage")
+
+# Bytes sent to the panel per refresh
+transfer_bytes = registry.histogram(
+    "epaper_transfer_bytes", "Bytes sent over SPI per refresh.",
+    buckets=(1024, 4096, 16384, 49152, 98304, 196608, 393216))
+
+# Refreshes by type: full, partial, or skipped when the frame was unchanged
+refreshes = registry.counter(
+    "epaper_refreshes_total", "Panel refreshes by type.", label="type")
+
+# Failed renders that were retried, and browser restarts after them
+capture_retries = registry.counter(
+    "epaper_capture_retries_total", "Failed screen captures that were retried.")
+browser_restarts = registry.counter(
+    "epaper_browser_restarts_total", "Renderer resets after a failed capture.")
+
+# Cloudflare DNS checks and updates: unchanged, updated, failed, skipped
+cloudflare_updates = registry.counter(
+    "epaper_cloudflare_updates_total", "Cloudflare DNS record checks by outcome.", label="outcome")
+
+
+def process_rss():
+    """Return the resident set size of this process in bytes, from /proc."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def open_fds():
+    """Return the number of file descriptors open in this process."""
+    return len(os.listdir("/proc/self/fd"))
+
+
+# Read from /proc when /metrics is scraped, nothing is sampled in between
+registry.gauge("process_resident_memory_bytes", "Resident memory size in bytes.", fn=process_rss)
+registry.gauge("process_open_fds", "Number of open file descriptors.", fn=open_fds)
+
+
+
+def span(stage):
+    """Time the block as *stage* of the refresh cycle."""
+    return stage_seconds.time(stage)
@@ -0,0 +1,210 @@
+import functools
+import logging
+import time
+from io import BytesIO
+
+import requests
+from PIL import Image, ImageDraw, ImageFont
+
+from metrics import span
+from screencast import CDPScreencast
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(size, path=FONT_PATH):
+    """Return a TrueType font of the given size, or Pillow's built-in font when it is missing."""
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:  # Pillow < 10.1
+            return ImageFont.load_default()
+
+
+class RenderError(Exception):
+    """The screen could not be rendered, even after resetting the renderer."""
+
+
+class Renderer:
+    """Source of the frames shown on the e-paper display."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def render(self, ip, second=False, force=False):
+        """Return the screen as a grayscale image of width x height.
+
+        Returns None when the content did not change since the previous frame
+        and *force* is not set.  *second* selects the alternative view.
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """Drop any state after a failed render, the next render starts afresh."""
+
+    def close(self):
+        """Release the resources held by the renderer."""
+        self.reset()
+
+
+class BrowserRenderer(Renderer):
+    """Renders the /screen page in a headless Chrome driven by Selenium.
+
+    backend "cdp" keeps the page loaded and takes frames over the DevTools
+    protocol (see CDPScreencast), "selenium" reloads the page and takes a
+    WebDriver screenshot every time; it is also the fallback when a CDP call
+    fails.
+    """
+
+    def __init__(self, width, height, base_url="https://localhost/screen", backend="cdp",
+                 chromedriver="/usr/bin/chromedriver"):
+        super().__init__(width, height)
+        self.base_url = base_url
+        self.backend = backend
+        self.chromedriver = chromedriver
+        self.browser = None
+        self.screencast = None
+
+    def get_browser(self):
+        """Return the browser, starting it (or a new one if the session died) when needed."""
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+
+        if self.browser is not None:
+            try:
+                # Sprawdź czy przeglądarka jest jeszcze aktywna
+                self.browser.current_url  # Proste sprawdzenie statusu
+                return self.browser
+            except Exception as e:
+                logging.warning("Browser session invalid, reinitializing: %s", e)
+                self.browser = None
+                self.screencast = None
+
+        logging.info("Initializing browser")
+        chrome_options = Options()
+        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--window-size=%d,%d" % (self.width, self.height + 45))
+        chrome_options.add_argument("--ignore-certificate-errors")
+        service = Service(self.chromedriver)
+        self.browser = webdriver.Chrome(service=service, options=chrome_options)
+        self.browser.set_page_load_timeout(30)  # Ustaw timeout
+        logging.info("Browser initialized successfully")
+        return self.browser
+
+    def url(self, ip, second=False):
+        url = f"{self.base_url}?ip={ip}"
+        if second:
+            url += "&second=true"
+        return url
+
+    def capture_screenshot(self, url, force=False):
+        """Return a PNG screenshot of the page, or None if it did not change since the last one."""
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+
+        browser = self.get_browser()
+        if self.backend == "cdp":
+            try:
+                if self.screencast is None:
+                    self.screencast = CDPScreencast(browser)
+                return self.screencast.capture(url, force)
+            except TimeoutException:
+                raise
+            except WebDriverException as e:
+                logging.warning("CDP capture failed, falling back to Selenium screenshot: %s", e)
+                self.screencast = None
+
+        browser.get(url)
+        return browser.get_screenshot_as_png()
+
+    def render(self, ip, second=False, force=False):
+        logging.info("Refreshing page content for screenshot capture")
+        with span("screenshot"):
+            screenshot = self.capture_screenshot(self.url(ip, second), force)
+        if screenshot is None:
+            return None
+        with BytesIO(screenshot) as screenshot_io, Image.open(screenshot_io) as image:
+            with span("decode"):
+                gray = image.convert('L')
+        with span("resize"), gray:
+            return gray.resize((self.width, self.height))
+
+    def reset(self):
+        if self.browser is not None:
+            try:
+                logging.info("Closing browser")
+                self.browser.quit()
+            except Exception as e:
+                logging.warning("Error closing browser: %s", e)
+        self.browser = None
+        self.screencast = None
+
+
+class LocalRenderer(Renderer):
+    """Draws the screen layout directly with PIL, without a browser.
+
+    Shows a clock, the date and the IP address, followed by the widgets
+    fetched as JSON from data_url, either ``{"widgets": [{"title": ...,
+    "value": ...}, ...]}`` or a flat object of title/value pairs.  Renders in
+    milliseconds and needs neither Chrome nor Selenium.
+    """
+
+    def __init__(self, width, height, data_url="https://localhost/screen/data", timeout=10):
+        super().__init__(width, height)
+        self.data_url = data_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.widgets = []
+
+    def fetch_widgets(self, ip, second=False):
+        """Return the widgets as (title, value) pairs, or the last known ones on failure."""
+        params = {"ip": ip}
+        if second:
+            params["second"] = "true"
+        try:
+            response = self.session.get(self.data_url, params=params, timeout=self.timeout, verify=False)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logging.warning("Failed to fetch screen data: %s", e)
+            return self.widgets
+
+        if isinstance(data, dict) and isinstance(data.get("widgets"), list):
+            items = [(w.get("title", ""), w.get("value", "")) for w in data["widgets"] if isinstance(w, dict)]
+        elif isinstance(data, dict):
+            items = list(data.items())
+        else:
+            items = []
+        self.widgets = [(str(title), str(value)) for title, value in items]
+        return self.widgets
+
+    def render(self, ip, second=False, force=False):
+        widgets = self.fetch_widgets(ip, second)
+        now = time.localtime()
+
+        image = Image.new('L', (self.width, self.height), 255)
+        draw = ImageDraw.Draw(image)
+        margin = 24
+        draw.text((margin, 8), time.strftime("%H:%M", now), font=load_font(96), fill=0)
+        draw.text((margin, 116), time.strftime("%d.%m.%Y", now), font=load_font(28), fill=0)
+        draw.text((self.width - margin, 16), f"IP: {ip}", font=load_font(20), fill=0, anchor="ra")
+        draw.line((margin, 160, self.width - margin, 160), fill=0, width=2)
+
+        font = load_font(28)
+        y = 180
+        for title, value in widgets:
+            if y + 36 > self.height:
+                break
+            draw.text((margin, y), title, font=font, fill=0)
+            draw.text((self.width - margin, y), value, font=font, fill=0, anchor="ra")
+            y += 40
+        return image
+
+    def close(self):
+        self.session.close()
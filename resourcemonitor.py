@@ -0,0 +1,105 @@
+import collections
+import logging
+import threading
+import time
+
+import psutil
+
+# Process resources at one point in time; chrome_* cover the child processes
+# (Chrome, chromedriver)
+Sample = collections.namedtuple("Sample", "time fds rss threads chrome_processes chrome_rss")
+
+
+class ResourceMonitor:
+    """Samples the resources of this process on a background thread.
+
+    Every *period* seconds it records the open file descriptors, resident
+    memory, thread count and the number and memory of the child processes
+    in a ring buffer of the last *keep* samples.  Nothing is logged unless a
+    value crosses its limit in *thresholds* (e.g. {"fds": 512}), in either
+    direction, or changed by more than its entry in *deltas* since the last
+    logged sample, so a steady process writes no log lines at all.
+    """
+
+    DELTAS = {"fds": 16, "rss": 32 * 1024 * 1024, "threads": 4, "chrome_processes": 1,
+              "chrome_rss": 64 * 1024 * 1024}
+
+    def __init__(self, period=60, keep=60, thresholds=None, deltas=None, name="resource-monitor"):
+        self.period = period
+        self.samples = collections.deque(maxlen=keep)
+        self.thresholds = thresholds or {}
+        self.deltas = self.DELTAS if deltas is None else deltas
+        self.process = psutil.Process()
+        self.logged = None
+        # fields over their threshold in the last sample
+        self.over = set()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def sample(self):
+        """Take a sample, add it to the ring buffer and return it."""
+        process = self.process
+        with process.oneshot():
+            rss = process.memory_info().rss
+            fds = process.num_fds() if hasattr(process, "num_fds") else process.num_handles()
+            threads = process.num_threads()
+        chrome_processes = chrome_rss = 0
+        for child in process.children(recursive=True):
+            try:
+                chrome_rss += child.memory_info().rss
+                chrome_processes += 1
+            except psutil.Error:
+                pass  # exited in the meantime
+        sample = Sample(time.time(), fds, rss, threads, chrome_processes, chrome_rss)
+        self.samples.append(sample)
+        return sample
+
+    def latest(self):
+        """Return the last sample, or None before the first one."""
+        return self.samples[-1] if self.samples else None
+
+    def check(self, sample):
+        """Log *sample* when a value crosses its threshold or moved by more than its delta.
+
+        A value over its limit is logged as a WARNING once, when it goes
+        over, and as INFO when it is back under the limit.
+        """
+        over = {field for field, limit in self.thresholds.items() if getattr(sample, field) > limit}
+        crossed = ["%s over %d" % (field, self.thresholds[field]) for field in sorted(over - self.over)]
+        reasons = crossed + ["%s back under %d" % (field, self.thresholds[field])
+                             for field in sorted(self.over - over)]
+        self.over = over
+        if self.logged is None:
+            reasons.append("first sample")
+        else:
+            for field, delta in self.deltas.items():
+                change = getattr(sample, field) - getattr(self.logged, field)
+                if abs(change) >= delta:
+                    reasons.append("%s changed by %+d" % (field, change))
+        if not reasons:
+            return False
+        logging.log(logging.WARNING if crossed else logging.INFO,
+                    "Resources (%s): %d open fds, %.1f MB RSS, %d threads, %d child processes using %.1f MB",
+                    ", ".join(reasons), sample.fds, sample.rss / 1e6, sample.threads,
+                    sample.chrome_processes, sample.chrome_rss / 1e6)
+        self.logged = sample
+        return True
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.check(self.sample())
+            except Exception as e:
+                logging.error("Failed to sample process resources: %s", e)
+            self.stopped.wait(self.period)
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        """Return the last samples as dicts, oldest first."""
+        return [sample._asdict() for sample in self.samples]
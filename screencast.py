@@ -0,0 +1,76 @@
+import base64
+import logging
+import time
+
+# Counts DOM mutations of the page, so a capture can be skipped while nothing
+# on the screen changed. Installed before any page script runs.
+CHANGE_COUNTER_SCRIPT = """
+window.__epaperChanges = 0;
+new MutationObserver(function () { window.__epaperChanges++; }).observe(document, {
+    subtree: true, childList: true, attributes: true, characterData: true
+});
+"""
+
+
+class CDPScreencast:
+    """Keeps the screen page loaded in Chrome and grabs frames over the DevTools protocol.
+
+    Instead of reloading the page and taking a WebDriver screenshot every
+    time, the page stays open and Page.captureScreenshot is only called when
+    a MutationObserver saw the DOM change since the last frame.  Changes the
+    observer cannot see (canvas, CSS animations) are picked up by
+    max_frame_age, and the page is reloaded every reload_interval seconds to
+    keep a long running page from leaking memory.
+    """
+
+    def __init__(self, browser, max_frame_age=300, reload_interval=60 * 60):
+        self.browser = browser
+        self.max_frame_age = max_frame_age
+        self.reload_interval = reload_interval
+        self.url = None
+        self.loaded_at = 0
+        self.captured_at = 0
+        self.changes = None
+        browser.execute_cdp_cmd("Page.enable", {})
+        browser.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": CHANGE_COUNTER_SCRIPT})
+
+    def load(self, url):
+        """Load *url*, the page then stays open for the following captures."""
+        logging.info("Loading page for screencast: %s", url)
+        self.browser.get(url)
+        self.url = url
+        self.loaded_at = time.time()
+        self.changes = None
+
+    def change_count(self):
+        """Return the number of DOM mutations seen since the page was loaded."""
+        result = self.browser.execute_cdp_cmd("Runtime.evaluate", {
+            "expression": "window.__epaperChanges",
+            "returnByValue": True,
+        })
+        return result.get("result", {}).get("value")
+
+    def capture(self, url, force=False):
+        """Return a PNG screenshot of the page, or None when nothing changed.
+
+        A different *url* or an old page triggers a reload; *force* always
+        takes a new frame.
+        """
+        now = time.time()
+        if url != self.url or now - self.loaded_at > self.reload_interval:
+            self.load(url)
+            force = True
+
+        changes = self.change_count()
+        unchanged = changes is not None and changes == self.changes
+        if not force and unchanged and now - self.captured_at < self.max_frame_age:
+            return None
+
+        result = self.browser.execute_cdp_cmd("Page.captureScreenshot", {
+            "format": "png",
+            "optimizeForSpeed": True,
+            "captureBeyondViewport": False,
+        })
+        self.changes = changes
+        self.captured_at = now
+        return base64.b64decode(result["data"])